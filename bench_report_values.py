@@ -0,0 +1,262 @@
+######################################################################################
+# This file is used to measure extract_report_values.py on large, made-up reports.   #
+#                                                                                    #
+# It can be run by opening a Python terminal & entering:                             #
+# "bench_report_values.py --rows 10000 100000"                                       #
+#                                                                                    #
+# without the double quotes. A report is generated for each number of rows & the    #
+# time & peak memory of each stage (load_report, check_clean, get_values,           #
+# export_values, & stream_values end to end) are printed. Add --baseline <file.json> #
+# to compare against an earlier run (flagging anything slower or bigger than         #
+# --tolerance allows) & --save to store this run as the new baseline.               #
+#                                                                                    #
+######################################################################################
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from extract_report_values import check_clean, export_values, get_values, load_report, stream_values
+
+#columns of a generated report; the 7 used by extract_report_values.py are mixed in with others, as in a real DMR export
+HEADER_ROW = [
+    "Permit ID",
+    "Facility Name",
+    "Outfall",
+    "Sample Point Description",
+    "DMR Parameter Description Abbrv.",
+    "Mon. Period Start Date",
+    "Mon. Period End Date",
+    "Concentrated Average Stat Base",
+    "Reported Value Concentration Avg",
+    "Concentration Maximum Stat Base",
+    "Reported Value Concentration Max",
+    "Concentration Units",
+    "Nodi Code"
+]
+
+#parameter: (typical value, spread, units)
+PARAMETERS = {
+    "Temperature,  oC": (18.0, 6.0, "deg C"),
+    "pH": (7.2, 0.5, "SU"),
+    "Nitrogen, Ammonia Total (as N)": (1.5, 1.5, "mg/L"),
+    "Flow, In Conduit or Thru Treatment Plant": (2.0, 1.0, "MGD"),
+    "BOD, 5-Day (20 Deg. C)": (8.0, 4.0, "mg/L"),
+    "Solids, Total Suspended": (10.0, 5.0, "mg/L"),
+    "Coliform, Fecal General": (40.0, 30.0, "#/100mL"),
+    "Chlorine, Total Residual": (0.05, 0.05, "mg/L"),
+    "Oxygen, Dissolved (DO)": (7.0, 1.5, "mg/L"),
+    "Phosphorus, Total (as P)": (1.0, 0.8, "mg/L"),
+    "Copper, Total Recoverable": (0.01, 0.01, "mg/L"),
+    "Zinc, Total Recoverable": (0.05, 0.03, "mg/L"),
+}
+SAMPLE_POINTS = ["Effluent Gross Value", "Raw Sewage Influent", "Percent Removal"]
+NON_DETECTS = ["<0.1", "<0.05", "ND"]
+
+def _format_date(year, month, style):
+    if style == 0:
+        return f"{month}/1/{year}"
+    return f"{month:02d}/01/{year} 00:00"
+
+def _format_value(rng, mean, spread):
+    pick = rng.random()
+    if pick < 0.05:
+        return ""
+    if pick < 0.08:
+        return rng.choice(NON_DETECTS)
+    return f"{max(0.0, rng.gauss(mean, spread)):.3g}"
+
+def iter_generated_rows(rows, seed=0, years=10):
+    """
+    Yield realistic DMR-style rows, the same ones every time for the same arguments.
+
+    Each facility reports every parameter for every sample point each month for `years` years, newest month last,
+    with both date formats, blanks, & non-detect values mixed in. Facilities are added until `rows` rows are yielded.
+
+    Args:
+        rows - int; number of rows to yield.
+        seed - int; seed for the random values.
+        years - int; years of monthly reports per facility.
+
+    Yields:
+        row - list; values for HEADER_ROW.
+    """
+    rng = random.Random(seed)
+    count = 0
+    facility = 0
+    while count < rows:
+        facility += 1
+        permit = f"WA{facility:07d}"
+        name = f"Facility {facility} WWTP"
+        outfall = f"{rng.randint(1, 3):03d}"
+        date_style = facility % 2 #* facilities alternate between the two date formats
+        for year in range(2024 - years, 2024):
+            for month in range(1, 13):
+                start = _format_date(year, month, date_style)
+                end = _format_date(year, month, date_style)
+                for parameter, (mean, spread, units) in PARAMETERS.items():
+                    for point in SAMPLE_POINTS:
+                        if count >= rows:
+                            return
+                        yield [
+                            permit, name, outfall, point, parameter, start, end,
+                            "MO AVG", _format_value(rng, mean, spread),
+                            "DAILY MX", _format_value(rng, mean * 1.3, spread),
+                            units, ""
+                        ]
+                        count += 1
+
+def generate_report(fname, rows, seed=0, years=10):
+    """
+    Write a made-up report of `rows` rows, see iter_generated_rows(). Rows are written as they are made, so any size fits in memory.
+
+    Args:
+        fname - string; name of the .csv file to write.
+        rows - int; number of rows, not counting the header.
+        seed - int; seed for the random values.
+        years - int; years of monthly reports per facility.
+
+    Returns:
+        fname - string; the same fname.
+    """
+    with open(fname, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HEADER_ROW)
+        writer.writerows(iter_generated_rows(rows, seed, years))
+
+    return fname
+
+def _measure(func, *args, trace=False):
+    """
+    Run func(*args) & return its result, the seconds it took, & (with trace) its peak traced memory in MB.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20 if trace else None
+    finally:
+        if trace:
+            tracemalloc.stop()
+
+    return result, seconds, peak_mb
+
+def benchmark_report(fname, repeat=3):
+    """
+    Time each stage of extract_report_values.py on a report & record its peak memory.
+
+    Times are the best of `repeat` runs without tracing; peak memory comes from one more run with tracemalloc on,
+    which is slower, so the two are kept apart.
+
+    Args:
+        fname - string; the report to run.
+        repeat - int; number of timed runs.
+
+    Returns:
+        stages - dictionary; keys = stage name, values = {"seconds": float, "peak_mb": float}.
+    """
+    stages = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for trace in [False] * repeat + [True]:
+            this_file_dict, load_s, load_mb = _measure(load_report, fname, trace=trace)
+            dict_clean, clean_s, clean_mb = _measure(check_clean, this_file_dict, trace=trace)
+            del this_file_dict
+            found_values, values_s, values_mb = _measure(get_values, dict_clean, trace=trace)
+            del dict_clean
+            _, export_s, export_mb = _measure(export_values, found_values, fname, out_dir, trace=trace)
+            _, stream_s, stream_mb = _measure(stream_values, fname, trace=trace)
+
+            for stage, seconds, peak_mb in [
+                ("load_report", load_s, load_mb),
+                ("check_clean", clean_s, clean_mb),
+                ("get_values", values_s, values_mb),
+                ("export_values", export_s, export_mb),
+                ("stream_values", stream_s, stream_mb),
+            ]:
+                this_stage = stages.setdefault(stage, {"seconds": seconds, "peak_mb": None})
+                if trace:
+                    this_stage["peak_mb"] = round(peak_mb, 3)
+                else:
+                    this_stage["seconds"] = round(min(this_stage["seconds"], seconds), 4)
+
+    return stages
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """
+    Flag stages that got slower or bigger than a baseline run allows.
+
+    Args:
+        results - dictionary; keys = number of rows (string), values = stages from benchmark_report().
+        baseline - dictionary; same layout, from an earlier run.
+        tolerance - float; allowed increase, 0.25 = 25%.
+
+    Returns:
+        regressions - list; one message per stage & measure over the tolerance.
+    """
+    regressions = []
+    for rows, stages in results.items():
+        for stage, measures in stages.items():
+            before = baseline.get(rows, {}).get(stage)
+            if before is None:
+                continue
+            for measure in ["seconds", "peak_mb"]:
+                if before.get(measure) and measures[measure] > before[measure] * (1 + tolerance):
+                    regressions.append(f"{stage} @ {rows} rows: {measure} {before[measure]} -> {measures[measure]}")
+
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark extract_report_values.py on made-up reports.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="report sizes to run, e.g. 10000 1000000 10000000")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the made-up values")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage; the best is kept")
+    parser.add_argument("--baseline", help="JSON file with an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed increase over the baseline, 0.25 = 25%%")
+    parser.add_argument("--save", action="store_true", help="store this run in the --baseline file")
+    parser.add_argument("--keep-dir", help="keep the generated reports in this folder (reused if already there)")
+    args = parser.parse_args()
+
+    report_dir = args.keep_dir or tempfile.mkdtemp()
+    os.makedirs(report_dir, exist_ok=True)
+    results = {}
+    try:
+        for rows in args.rows:
+            fname = os.path.join(report_dir, f"bench_{rows}_{args.seed}.csv")
+            if not os.path.exists(fname):
+                generate_report(fname, rows, seed=args.seed)
+            results[str(rows)] = benchmark_report(fname, repeat=args.repeat)
+            for stage, measures in results[str(rows)].items():
+                print(f"{rows:>10} rows  {stage:<14} {measures['seconds']:>9.4f} s  {measures['peak_mb']:>10.3f} MB")
+    finally:
+        if not args.keep_dir:
+            for name in os.listdir(report_dir):
+                os.remove(os.path.join(report_dir, name))
+            os.rmdir(report_dir)
+
+    regressions = []
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if not regressions:
+            print(f"No regressions against {args.baseline}.")
+    else:
+        baseline = {}
+
+    if args.save and args.baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as outfile:
+            json.dump(baseline, outfile, indent=2, sort_keys=True)
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,50 @@
+import unittest
+import os
+import tempfile
+from bench_report_values import *
+from extract_report_values import stream_values
+
+class Test_generate_report(unittest.TestCase):
+    """
+    Test generate_report() makes the same usable report every time for the same seed.
+    """
+
+    def test_deterministic(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            a = generate_report(os.path.join(report_dir, "a.csv"), 5000, seed=1)
+            b = generate_report(os.path.join(report_dir, "b.csv"), 5000, seed=1)
+            c = generate_report(os.path.join(report_dir, "c.csv"), 5000, seed=2)
+            with open(a) as file_a, open(b) as file_b, open(c) as file_c:
+                text_a = file_a.read()
+                self.assertEqual(text_a, file_b.read())
+                self.assertNotEqual(text_a, file_c.read())
+            self.assertEqual(len(text_a.splitlines()), 5001)
+
+    def test_mixed_values(self):
+        rows = list(iter_generated_rows(20000, seed=0))
+        values = [row[8] for row in rows] + [row[10] for row in rows]
+        self.assertIn("", values)
+        self.assertIn("ND", values)
+        self.assertEqual({len(row[5].split()) for row in rows}, {1, 2}) # with & without hours, mins
+
+    def test_extracts(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            x = stream_values(generate_report(os.path.join(report_dir, "a.csv"), 5000))
+            self.assertEqual(len(x["pH summer values"]), 30)
+
+class Test_compare_to_baseline(unittest.TestCase):
+    """
+    Test compare_to_baseline() only flags increases over the tolerance.
+    """
+
+    def test_regressions(self):
+        baseline = {"10000": {"load_report": {"seconds": 1.0, "peak_mb": 10.0}}}
+        results = {
+            "10000": {"load_report": {"seconds": 1.2, "peak_mb": 20.0}, "new_stage": {"seconds": 5.0, "peak_mb": 5.0}},
+            "50000": {"load_report": {"seconds": 9.0, "peak_mb": 90.0}},
+        }
+        regressions = compare_to_baseline(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("peak_mb", regressions[0])
+
+unittest.main(verbosity=2)
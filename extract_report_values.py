@@ -7,383 +7,2528 @@
 # without the double quotes & where <file_name.csv> is the file you want to extract  # 
 # values from. Results will be saved in a new .csv file with the name:               #
 # <datetime>_VALUES_FOR-<file_name>.csv                                              #
+#                                                                                    #
+# Add --stream for very large reports to read them in a single pass with flat memory.#
+# Add --parallel <workers> to split one very large .csv report across processes.     #
+# Reports may also be compressed (.csv.gz, .csv.bz2, .csv.xz) or in a .zip file;     #
+# they are read as they are decompressed. Excel workbooks (.xlsx) are read directly  #
+# from their first sheet, with no need to save them as .csv first.                   #
+#                                                                                    #
+# Several files, a folder, or a glob pattern (e.g. "reports/*.csv") run in batch     #
+# mode across all CPUs; see --workers, --out-dir, & --manifest. A manifest .csv      #
+# lists each file with its status, output file, time taken, & any error.             #
+#                                                                                    #
+# Add --partition-by "Permit ID" (repeat for more columns) to export values for each #
+# permit, outfall, etc. in a state-wide report separately, in one read of the file.  #
+# Add --as-of 2014-01..2023-12 to export the values as they were at each month-end   #
+# (or --as-of <YYYY-MM-DD> for chosen dates), also in one read of the file.          #
+#                                                                                    #
+# Add --profile to print the time, rows, & peak memory of each stage (read, normalize,#
+# filter, bucket, export), or --profile-json to save them next to the output file.   #
+#                                                                                    #
+# Add --format long or --format jsonl for one row per value instead of the layout    #
+# above, & --output <file> to choose the file name (--output - prints the results).  #
+# --format stats gives the max, mean, geometric mean, & percentiles of each bucket,  #
+# counting non-detects (e.g. "<0.1") at their detection limit.                       #
+#                                                                                    #
+# Add --dedup first (or last) to drop rows for a monitoring period that was reported #
+# more than once, keeping the first (or last) one, or --dedup flag to list them.     #
+#                                                                                    #
+# Add --cache <folder> when the same reports are run every month: unchanged reports  #
+# are skipped & reports with new rows added at the end only read the new rows.       #
+#                                                                                    #
+# From Python, extract(<file, open file, or rows>) returns the values with numbers & #
+# dates already parsed, without writing anything to disk.                            #
 #                                                                                    #   
 ######################################################################################
 
+import argparse
+import bisect
+import bz2
 import collections
-import copy
+import concurrent.futures
+import contextlib
 import csv
 import datetime
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import locale
+import lzma
+import math
+import operator
 import os
+import pickle
+import re
 import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+import zipfile
+
+#columns we'll use during processing
+THESE_KEYS = [
+    "Sample Point Description",         #string
+    "DMR Parameter Description Abbrv.", #string
+    "Concentrated Average Stat Base",   #string
+    "Concentration Maximum Stat Base",  #string
+    "Mon. Period Start Date",           #date
+    "Reported Value Concentration Avg", #float
+    "Reported Value Concentration Max"  #float
+]
+THESE_KEYS_LOWER = [entry.lower() for entry in THESE_KEYS]
+ENCODING = locale.getpreferredencoding(False) #* same as open() uses by default
+STRING_KEYS = THESE_KEYS_LOWER[:4] #* trimmed & lower-cased by clean_row()
+VALUE_KEYS = THESE_KEYS_LOWER[5:] #* reported values, left as strings
+
+class ReportRow:
+    """
+    Compact record for one row of a report, holding only the columns in THESE_KEYS.
+
+    Values can be read & updated by lower-cased column name, same as the dictionaries from load_report().
+    Values of any other columns asked for (see iter_report()) are kept as a tuple in `extra`.
+    """
+
+    #attribute per column in THESE_KEYS, same order
+    COLUMNS = (
+        "sample_point",
+        "parameter",
+        "avg_stat_base",
+        "max_stat_base",
+        "start_date",
+        "value_avg",
+        "value_max"
+    )
+    __slots__ = COLUMNS + ("extra",)
+    FIELDS = dict(zip(THESE_KEYS_LOWER, COLUMNS))
+
+    def __init__(self, sample_point, parameter, avg_stat_base, max_stat_base, start_date, value_avg, value_max, extra=()):
+        self.sample_point = sample_point
+        self.parameter = parameter
+        self.avg_stat_base = avg_stat_base
+        self.max_stat_base = max_stat_base
+        self.start_date = start_date
+        self.value_avg = value_avg
+        self.value_max = value_max
+        self.extra = extra
+
+    def __getitem__(self, key):
+        return getattr(self, self.FIELDS[key])
+
+    def __setitem__(self, key, value):
+        setattr(self, self.FIELDS[key], value)
+
+    def __eq__(self, other):
+        if not isinstance(other, ReportRow):
+            return NotImplemented
+        return self.values() == other.values() and self.extra == other.extra
+
+    def __repr__(self):
+        return f"ReportRow{self.values()!r}"
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.COLUMNS)
+
+    def items(self):
+        return list(zip(self.FIELDS, self.values()))
+
+    def copy(self):
+        return ReportRow(*self.values(), extra=self.extra)
+
+class StartDateParser:
+    """
+    Parse values from "Mon. Period Start Date", remembering each raw string already parsed.
+
+    A report only has a handful of distinct start dates (one per month) repeated across many rows, so most values come from the cache.
+    New values in the usual "8/1/2016" or "8/1/2016 0:00" shapes are parsed directly; anything else falls back to strptime(),
+    trying the format that last worked first. (Excel date serials from .xlsx reports are turned into text first, see iter_xlsx_rows().)
+    """
+
+    FORMATS = ["%m/%d/%Y %H:%M", "%m/%d/%Y"] #* try without hours, mins
+    PATTERN = re.compile(r"([0-9]{1,2})/([0-9]{1,2})/([0-9]{4})(?: ([0-9]{1,2}):([0-9]{2}))?")
+    MAX_CACHED = 4096 #* plenty for one value per month; stops an odd file from growing the cache without limit
+
+    def __init__(self):
+        self.cache = {}
+        self.shapes = {} #* raw string: format it was parsed with, for RunMetrics
+        self.formats = list(self.FORMATS)
+
+    def parse(self, value):
+        """
+        Args:
+            value - string; non-empty value from "Mon. Period Start Date".
+
+        Returns:
+            datetime.datetime; the parsed value.
+        """
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+
+        date, shape = self._parse(value)
+        if len(self.cache) >= self.MAX_CACHED:
+            self.cache.clear()
+            self.shapes.clear()
+        self.cache[value] = date
+        self.shapes[value] = shape
+        return date
+
+    def _parse(self, value):
+        match = self.PATTERN.fullmatch(value)
+        if match:
+            month, day, year, hour, minute = match.groups()
+            try:
+                date = datetime.datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+                return date, self.FORMATS[0] if hour else self.FORMATS[1]
+            except ValueError:
+                pass #* e.g. 2/30/2016; let strptime() have the final say
+
+        for i, fmt in enumerate(self.formats):
+            try:
+                date = datetime.datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            if i > 0:
+                self.formats.insert(0, self.formats.pop(i))
+            return date, fmt
+
+        raise ValueError("\nERROR: Cannot process value in Mon. Period Start Date.\nCheck source file.\n")
+
+DATE_PARSER = StartDateParser()
+
+class NumericParser:
+    """
+    Parse reported values into a number & a qualifier flag, remembering each raw string already parsed.
+
+    Reports repeat the same values ("<0.1", "ND", blanks, common readings) across many rows, so most values come from the cache.
+    Flags: "" for a measured value, "<" below the detection limit given as the number, ">" above the limit given,
+    "nd" for a non-detect with no limit, "blank" when nothing was reported, & "text" for anything else (e.g. "E", "see comments").
+    """
+
+    PATTERN = re.compile(r"([<>])?=?\s*([-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?)")
+    NON_DETECT_CODES = {"nd", "bdl", "bql", "non-detect", "not detected"}
+    NON_DETECT_FLAGS = ("<", "nd")
+    MAX_CACHED = 65536 #* far more than the distinct values in a report's value columns
+
+    def __init__(self):
+        self.cache = {}
+
+    def parse(self, value):
+        """
+        Args:
+            value - string; a reported value, e.g. "1.5", "<0.1", "ND", or "".
+
+        Returns:
+            (number, flag) - tuple; float (None for "nd", "blank", & "text") & qualifier flag.
+        """
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+
+        parsed = self._parse(value)
+        if len(self.cache) >= self.MAX_CACHED:
+            self.cache.clear()
+        self.cache[value] = parsed
+        return parsed
+
+    def _parse(self, value):
+        value = (value or "").strip()
+        if not value:
+            return None, "blank"
+        match = self.PATTERN.fullmatch(value)
+        if match:
+            return float(match.group(2)), match.group(1) or ""
+        if value.lower() in self.NON_DETECT_CODES:
+            return None, "nd"
+        return None, "text"
+
+    def parse_many(self, values):
+        """
+        parse() a whole column of values at once.
+
+        Returns:
+            (numbers, flags) - tuple; list of floats (or None) & list of flags, same order as values.
+        """
+        cache = self.cache
+        parse = self.parse
+        parsed = [cache[value] if value in cache else parse(value) for value in values]
+        return [number for number, _ in parsed], [flag for _, flag in parsed]
+
+NUMERIC_PARSER = NumericParser()
+
+def _max_numbers(values):
+    """
+    Numbers for the max of a bucket, see _gather_values(): measured values as they are, anything else (non-detects included) as 0.0.
+    """
+    numbers, flags = NUMERIC_PARSER.parse_many(values)
+    return [number if flag == "" else 0.0 for number, flag in zip(numbers, flags)]
+
+STATS_PERCENTILES = (50, 95, 99)
+ND_POLICIES = ("limit", "half", "zero", "exclude") #* what a non-detect counts as in value_stats()
+NUMPY_MIN_VALUES = 1000 #* smaller buckets are quicker without NumPy's overhead per call
+
+def _percentile(ordered, q):
+    """
+    Linear interpolation between the closest ranks, same as NumPy's default.
+    """
+    position = (len(ordered) - 1) * q / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def _stats_numbers(numbers, flags, non_detect):
+    """
+    The numbers value_stats() works from: measured & ">" values as they are, non-detects as non_detect says, blanks & text left out.
+    """
+    if non_detect not in ND_POLICIES:
+        raise ValueError(f'\nERROR: Unknown non-detect policy "{non_detect}". Use one of: {", ".join(ND_POLICIES)}.\n')
 
-def check_clean(this_dict):
+    used = []
+    for number, flag in zip(numbers, flags):
+        if flag == "" or flag == ">":
+            used.append(number)
+        elif flag == "<":
+            if non_detect == "limit":
+                used.append(number)
+            elif non_detect == "half":
+                used.append(number / 2)
+            elif non_detect == "zero":
+                used.append(0.0)
+        elif flag == "nd" and non_detect == "zero":
+            used.append(0.0)
+
+    return used
+
+def _numpy():
+    """
+    NumPy, or None when it isn't installed. Imported on first use, so reports without large buckets never load it.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def numeric_stats(numbers, flags, percentiles=STATS_PERCENTILES, non_detect="limit", engine=None):
+    """
+    Same as value_stats() for values already parsed, e.g. BucketValues.values & flags.
+    """
+    used = _stats_numbers(numbers, flags, non_detect)
+    np = None
+    if engine is None:
+        np = _numpy() if len(used) >= NUMPY_MIN_VALUES else None
+        engine = "python" if np is None else "numpy"
+    elif engine not in ("numpy", "python"):
+        raise ValueError(f'\nERROR: Unknown stats engine "{engine}". Use numpy or python.\n')
+    elif engine == "numpy":
+        np = _numpy()
+        if np is None:
+            raise ValueError("\nERROR: NumPy is not installed. Use engine=\"python\".\n")
+
+    stats = {
+        "n": len(flags),
+        "measured": sum(1 for flag in flags if flag == ""),
+        "above_limit": sum(1 for flag in flags if flag == ">"),
+        "non_detects": sum(1 for flag in flags if flag in NumericParser.NON_DETECT_FLAGS),
+        "max": None,
+        "mean": None,
+        "geomean": None,
+    }
+    stats.update((f"p{q:g}", None) for q in percentiles)
+    if not used:
+        return stats
+
+    if engine == "numpy":
+        array = np.asarray(used, dtype=float)
+        positive = array[array > 0]
+        stats["max"] = float(array.max())
+        stats["mean"] = float(array.mean())
+        stats["geomean"] = float(np.exp(np.log(positive).mean())) if len(positive) else None
+        stats.update((f"p{q:g}", float(value)) for q, value in zip(percentiles, np.percentile(array, percentiles)))
+    else:
+        ordered = sorted(used)
+        positive = [number for number in ordered if number > 0]
+        stats["max"] = ordered[-1]
+        stats["mean"] = math.fsum(ordered) / len(ordered)
+        stats["geomean"] = math.exp(math.fsum(map(math.log, positive)) / len(positive)) if positive else None
+        stats.update((f"p{q:g}", _percentile(ordered, q)) for q in percentiles)
+
+    return stats
+
+def value_stats(values, percentiles=STATS_PERCENTILES, non_detect="limit", engine=None):
+    """
+    Summary statistics of a bucket's values for reasonable-potential analysis, keeping count of non-detects.
+
+    Args:
+        values - list; reported values, as strings, see NumericParser.
+        percentiles - list; percentiles to work out, 0 to 100.
+        non_detect - string; what a non-detect counts as: its detection limit ("limit"), half of it ("half"), 0 ("zero"), or nothing ("exclude").
+            Non-detects without a limit only count with "zero"; blanks & text never count.
+        engine - string; "numpy" or "python". None uses NumPy when it's installed & there are at least NUMPY_MIN_VALUES numbers.
+
+    Returns:
+        stats - dictionary; n (all values), measured, above_limit (">" values), non_detects, max, mean, geomean (of values above 0), & p<percentile> for each
+            percentile. Statistics are None when no values count.
+    """
+    numbers, flags = NUMERIC_PARSER.parse_many(values)
+
+    return numeric_stats(numbers, flags, percentiles, non_detect, engine)
+
+def clean_row(values_dict, date_parser=DATE_PARSER):
+    """
+    Update the values of a single row from a report file for processing.
+
+    Args:
+        values_dict - dictionary or ReportRow; one row of a report, keys are lower-cased column names. Edited in place.
+        date_parser - StartDateParser; parses "Mon. Period Start Date", shared by all rows by default.
+
+    Returns:
+        values_dict - dictionary or ReportRow; the same, updated values_dict.
+    """
+    if type(values_dict) is ReportRow:
+        return _clean_report_row(values_dict, date_parser)
+
+    #enforce data types
+    #string values
+    for entry in STRING_KEYS:
+        value = values_dict[entry].strip()
+        values_dict[entry] = value.lower() if value else None #* blank or all spaces becomes None
+
+    #date values
+    for entry in ["mon. period start date"]:
+        if len(values_dict[entry]) == 0:
+            values_dict[entry] = None
+        else:
+            values_dict[entry] = date_parser.parse(values_dict[entry])
+
+    return values_dict
+
+def _clean_report_row(row, date_parser):
+    """
+    Same as clean_row() for a ReportRow, using its attributes directly instead of looking up each column by name.
+    """
+    value = row.sample_point.strip()
+    row.sample_point = value.lower() if value else None
+    value = row.parameter.strip()
+    row.parameter = value.lower() if value else None
+    value = row.avg_stat_base.strip()
+    row.avg_stat_base = value.lower() if value else None
+    value = row.max_stat_base.strip()
+    row.max_stat_base = value.lower() if value else None
+
+    if len(row.start_date) == 0:
+        row.start_date = None
+    else:
+        row.start_date = date_parser.parse(row.start_date)
+
+    return row
+
+def check_clean(this_dict, in_place=False):
     """
     Spot check a dictionary representing a report file & update values for processing.
 
     Args:
         this_dict - dictionary; to be spot checked & values updated.
+        in_place - boolean; update the rows of this_dict directly instead of copies of them. Saves memory when the raw values aren't needed afterwards.
 
     Returns:
         this_dict_updated - dictionary; edited version of this_dict.
     """
-    this_dict_updated = copy.deepcopy(this_dict)
+    if in_place:
+        this_dict_updated = this_dict
+    else:
+        this_dict_updated = {line_num: values_dict.copy() for line_num, values_dict in this_dict.items()} #* values are strings, a shallow copy per row is enough
 
-    #enforce data types
+    date_parser = StartDateParser()
     for values_dict in this_dict_updated.values():
+        clean_row(values_dict, date_parser)
 
-        #string values
-        for entry in [
-            "sample point description",
-            "dmr parameter description abbrv.",
-            "concentrated average stat base",
-            "concentration maximum stat base"
-        ]:
+    return this_dict_updated
 
-            if (values_dict[entry].isspace()) or (len(values_dict[entry]) == 0):
-                values_dict[entry] = None
-                continue
+def _column_indices(header, this_file, columns=THESE_KEYS):
+    """
+    Find the position of each column from the header of a report.
 
-            values_dict[entry] = values_dict[entry].strip().lower()
+    Args:
+        header - list; column names from the first row of the report.
+        this_file - string; name of the report, for error messages.
+        columns - list; column names to find, any case.
 
-        #date values
-        for entry in ["mon. period start date"]:
-            if len(values_dict[entry]) == 0:
-                values_dict[entry] = None
-            else:
-                try:
-                    values_dict[entry] = datetime.datetime.strptime(values_dict[entry], "%m/%d/%Y %H:%M")
-                except:
-                    try:
-                        values_dict[entry] = datetime.datetime.strptime(values_dict[entry], "%m/%d/%Y") #* try without hours, mins
-                    except:
-                        raise ValueError("\nERROR: Cannot process value in Mon. Period Start Date.\nCheck source file.\n")
-        
-    return this_dict_updated
+    Returns:
+        indices - list; position in each row of the columns, same order.
+    """
+    positions = {name.lower(): i for i, name in enumerate(header)} #* last one wins for repeated names
+
+    #* verify all keys are in header
+    indices = []
+    for entry in columns:
+        if entry.lower() in positions:
+            indices.append(positions[entry.lower()])
+        else:
+            raise ValueError(f'\nERROR: {entry} not found in {this_file}\n')
 
-def load_report(this_file):
+    return indices
+
+class ReadProgress:
     """
-    Opens file specified by user & performs some simple quality checks.
+    How far iter_report() has read into a report, so a later call can pick up from there when rows are appended.
+    """
+
+    __slots__ = ("offset", "line_num", "empty_cols", "complete")
+
+    def __init__(self):
+        self.offset = 0 #* bytes read, always at the end of a row; 0 = header not read yet
+        self.line_num = 2 #* line number of the next row, to keep numbering consistent w csv file
+        self.empty_cols = set(range(len(THESE_KEYS))) #* cols without a value so far
+        self.complete = True #* False if the last row read had no line ending, i.e. it may still be growing
+
+#file endings read through a decompressor, see _open_report(); .zip files are read from the report inside them
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open, ".lzma": lzma.open}
+READ_BUFFER = 1 << 20 #* bytes decompressed per read, large to keep the number of calls into the decompressor down
+
+def report_stem(this_file):
+    """
+    Name of a report without its folder, compression, or file endings, e.g. "report" for "in/report.csv.gz".
+    """
+    stem, ext = os.path.splitext(os.path.basename(this_file))
+    if ext.lower() in COMPRESSED_OPENERS or ext.lower() == ".zip":
+        stem = os.path.splitext(stem)[0]
+
+    return stem
+
+def is_compressed(this_file):
+    """
+    True for reports read through a decompressor, see _open_report() & iter_xlsx_rows().
+    """
+    return os.path.splitext(this_file)[1].lower() in COMPRESSED_OPENERS or this_file.lower().endswith((".zip", ".xlsx"))
+
+def _zip_member(archive, this_file):
+    """
+    Pick the report in a .zip file: its only .csv file, or its only file.
+    """
+    names = [i.filename for i in archive.infolist() if not i.is_dir() and not i.filename.startswith("__MACOSX/")]
+    reports = [i for i in names if i.lower().endswith(".csv")] or names
+    if len(reports) != 1:
+        raise ValueError(f'\nERROR: {this_file} should hold one report, found {len(reports)}: {", ".join(reports) or "none"}.\n')
+
+    return reports[0]
+
+@contextlib.contextmanager
+def _open_report(this_file):
+    """
+    Open a report for reading bytes, decompressing gzip, bz2, xz, & zip files as they are read, with no file written in between.
+
+    Yields:
+        (infile, stop) - tuple; the open file & its size in bytes, or None for compressed files, which are read to the end.
+    """
+    ext = os.path.splitext(this_file)[1].lower()
+    if ext in COMPRESSED_OPENERS:
+        with COMPRESSED_OPENERS[ext](this_file, "rb") as raw, io.BufferedReader(raw, READ_BUFFER) as infile:
+            yield infile, None
+    elif ext == ".zip":
+        with zipfile.ZipFile(this_file) as archive:
+            with archive.open(_zip_member(archive, this_file)) as raw, io.BufferedReader(raw, READ_BUFFER) as infile:
+                yield infile, None
+    else:
+        with open(this_file, "rb") as infile:
+            yield infile, os.fstat(infile.fileno()).st_size #* rows appended while reading are left for next time
+
+def _read_lines(infile, progress, stop):
+    """
+    Yield decoded lines from a report opened in binary mode, keeping progress.offset at the end of the last line yielded.
+    Lines are read up to stop bytes, or to the end if stop is None.
+    """
+    while stop is None or progress.offset < stop:
+        line = infile.readline(-1 if stop is None else stop - progress.offset)
+        if not line:
+            break
+        progress.offset += len(line)
+        progress.complete = line.endswith(b"\n")
+        yield line.decode(ENCODING)
+
+XLSX_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+XLSX_DATE_COLUMNS = ["Mon. Period Start Date"] #* numbers in these columns are Excel date serials
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30) #* day 0 of Excel's 1900 date system, allowing for its 2/29/1900
+MAX_EXCEL_SERIAL = 2958465 #* 12/31/9999
+
+def _excel_date(value):
+    """
+    An Excel date serial like "42583" as the text a .csv report holds, "08/01/2016 00:00". Anything else is returned as it is.
+    """
+    try:
+        serial = float(value)
+    except ValueError:
+        return value
+    if not 0 < serial <= MAX_EXCEL_SERIAL:
+        return value
+    return (EXCEL_EPOCH + datetime.timedelta(minutes=round(serial * 1440))).strftime("%m/%d/%Y %H:%M")
+
+def _xlsx_column(letters):
+    """
+    Position of a cell from the letters of its reference, e.g. 0 for "A" (cell "A7") & 27 for "AB".
+    """
+    n = 0
+    for letter in letters.upper():
+        n = n * 26 + ord(letter) - 64
+
+    return n - 1
+
+def _xlsx_parts(archive):
+    """
+    Find the first sheet of an .xlsx file & its shared strings (None if it has none) from the workbook & its relationships.
+    """
+    with archive.open("xl/workbook.xml") as infile:
+        first_sheet = ET.parse(infile).find(".//{*}sheet").get(XLSX_REL_ID)
+    targets = {}
+    with archive.open("xl/_rels/workbook.xml.rels") as infile:
+        for rel in ET.parse(infile).iterfind("{*}Relationship"):
+            target = rel.get("Target")
+            target = target[1:] if target.startswith("/") else f"xl/{target}" #* absolute or relative to xl/
+            targets[rel.get("Id")] = target
+            if rel.get("Type", "").endswith("/sharedStrings"):
+                targets["sharedStrings"] = target
+
+    return targets[first_sheet], targets.get("sharedStrings")
+
+def _xlsx_text(elem):
+    """
+    Text of a shared or inline string, joining its formatting runs & skipping phonetic hints.
+    """
+    if elem is None:
+        return ""
+    return "".join(t.text or "" for t in elem.iterfind("{*}t")) + "".join(t.text or "" for t in elem.iterfind("{*}r/{*}t"))
+
+def _read_shared_strings(archive, name):
+    """
+    Read the shared strings of an .xlsx file once, one element at a time.
+    """
+    strings = []
+    if name is not None:
+        with archive.open(name) as infile:
+            for event, elem in ET.iterparse(infile):
+                if elem.tag.endswith("}si"):
+                    strings.append(_xlsx_text(elem))
+                    elem.clear()
+
+    return strings
+
+def _xlsx_row(elem, strings, tags, columns, date_cols=()):
+    """
+    Values of a <row> from an .xlsx sheet, see iter_xlsx_rows(). columns caches the position of each column's letters.
+    Number cells at the positions in date_cols are turned from date serials into text, see _excel_date().
+    """
+    cell_tag, value_tag, inline_tag = tags
+    row = []
+    for cell in elem:
+        if cell.tag != cell_tag:
+            continue
+        ref = cell.get("r")
+        if ref:
+            letters = ref.rstrip("0123456789")
+            col = columns.get(letters)
+            if col is None:
+                col = columns[letters] = _xlsx_column(letters)
+            if col > len(row):
+                row.extend([""] * (col - len(row))) #* empty cells are left out of the file
+        kind = cell.get("t")
+        if kind == "inlineStr":
+            value = _xlsx_text(cell.find(inline_tag))
+        else:
+            value = cell.findtext(value_tag) or ""
+            if kind == "s" and value:
+                value = strings[int(value)]
+            elif (kind is None or kind == "n") and value and len(row) in date_cols:
+                value = _excel_date(value)
+        row.append(value)
+
+    return row
+
+def iter_xlsx_rows(this_file, date_columns=XLSX_DATE_COLUMNS):
+    """
+    Yield the rows of the first sheet in an .xlsx file one at a time as its xml is decompressed & parsed, so memory stays flat however large the sheet is.
+
+    Values are kept the way Excel stores them: text & numbers as written (e.g. "7.2"). Date serials (e.g. "42583") in date_columns
+    are written out as dates ("08/01/2016 00:00") the way a .csv report holds them; numbers anywhere else are left alone.
 
     Args:
-        this_file - string; the file name provided by user through the command line.
+        this_file - string; the .xlsx file.
+        date_columns - list; names of the columns holding dates, any case, found in the first row.
+
+    Yields:
+        (row_num, row) - tuple; the row's number in the sheet & a list of its values, "" for empty cells.
+    """
+    with zipfile.ZipFile(this_file) as archive:
+        sheet, shared = _xlsx_parts(archive)
+        strings = _read_shared_strings(archive, shared)
+        with archive.open(sheet) as raw, io.BufferedReader(raw, READ_BUFFER) as infile:
+            parser = ET.iterparse(infile, events=("start",)) #* a row is complete once the next one starts, so end events aren't needed
+            root = next(parser)[1]
+            ns = root.tag[:root.tag.find("}") + 1] #* "{...}" of the worksheet, which differs for strict xlsx files
+            row_tag, sheet_data_tag = ns + "row", ns + "sheetData"
+            tags = (ns + "c", ns + "v", ns + "is")
+            columns = {}
+            date_names = {entry.lower() for entry in date_columns}
+            date_cols = None #* positions of date_columns, from the first row
+            sheet_data = None
+            last = None
+            row_num = 0
+            for event, elem in parser:
+                if elem.tag == row_tag:
+                    if last is not None:
+                        row_num = int(last.get("r", row_num + 1))
+                        row = _xlsx_row(last, strings, tags, columns, date_cols or ())
+                        if date_cols is None:
+                            date_cols = {i for i, name in enumerate(row) if name.strip().lower() in date_names}
+                        yield row_num, row
+                    sheet_data.clear() #* drop rows already read from the tree; elem is still filled in
+                    last = elem
+                elif elem.tag == sheet_data_tag:
+                    sheet_data = elem
+            if last is not None:
+                yield int(last.get("r", row_num + 1)), _xlsx_row(last, strings, tags, columns, date_cols or ())
 
+def is_path(source):
+    """
     Returns:
-        this_file_dict - dictionary; a cleaned, updated, & shortened dictionary based on this_file.
+        boolean; True if source names a file, False for an open file object or rows already in memory.
     """
+    return isinstance(source, (str, os.PathLike))
 
-    this_file_dict = {} #dictionary of dictionaries representing this_file; keys = line_num, values = dictionary
+def source_name(source):
+    """
+    Returns:
+        string; the file name of source, for messages. Open file objects without a name are "<stream>", rows in memory "<rows>".
+    """
+    if is_path(source):
+        return os.fspath(source)
+    if hasattr(source, "read"):
+        name = getattr(source, "name", None)
+        return name if isinstance(name, str) else "<stream>"
+    return "<rows>"
 
-    #columns we'll use during processing
-    THESE_KEYS = [
-        "Sample Point Description",         #string
-        "DMR Parameter Description Abbrv.", #string
-        "Concentrated Average Stat Base",   #string
-        "Concentration Maximum Stat Base",  #string
-        "Mon. Period Start Date",           #date
-        "Reported Value Concentration Avg", #float
-        "Reported Value Concentration Max"  #float
-    ]
+def _cell(value):
+    """
+    One value of a row given in memory as the string a .csv report would hold.
+    """
+    if type(value) is str:
+        return value
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%m/%d/%Y %H:%M")
+    if isinstance(value, datetime.date):
+        return value.strftime("%m/%d/%Y")
+    return str(value)
 
-    with open(this_file, "r") as infile:
-        HEADER = next(infile)
-        HEADER_split = [i.lower() for i in HEADER.split(",")]
+@contextlib.contextmanager
+def _open_stream(infile):
+    """
+    Read a CSV report from a file object already open, text or binary, from where it is to its end. The file object is left open.
 
-        #* verify all keys are in header
-        for entry in THESE_KEYS:
-            if entry.lower() in HEADER_split:
-                continue
-            else:
-                raise ValueError(f'\nERROR: {entry} not found in {this_file}\n')
+    Yields:
+        (header, rows) - tuple; see _open_rows().
+    """
+    wrapped = not isinstance(infile, io.TextIOBase)
+    if wrapped:
+        infile = io.TextIOWrapper(infile, encoding=ENCODING, newline="")
+    try:
+        HEADER = infile.readline()
+        header = HEADER.rstrip("\r\n").split(",") if HEADER else None
+        yield header, csv.reader(infile)
+    finally:
+        if wrapped:
+            infile.detach() #* closing the wrapper would close the caller's file object
+
+def _iter_row_source(rows):
+    """
+    Read a report given as rows in memory: dictionaries (e.g. from csv.DictReader) keyed by column name, or lists with the column names first.
+    Values other than strings are written as they would be in a .csv report, see _cell().
+
+    Returns:
+        (header, rows) - tuple; see _open_rows().
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None, iter(())
+    if hasattr(first, "keys"):
+        header = list(first.keys())
+        getter = operator.itemgetter(*header)
+        if len(header) == 1:
+            return header, ([_cell(getter(row))] for row in itertools.chain([first], rows))
+        return header, ([_cell(value) for value in getter(row)] for row in itertools.chain([first], rows))
+
+    return [_cell(name) for name in first], ([_cell(value) for value in row] for row in rows)
+
+@contextlib.contextmanager
+def _open_rows(this_file, progress, stop=None):
+    """
+    Open a report & yield its column names & its rows after those already read by progress, keeping progress updated.
+    With stop, CSV rows are only read up to that byte offset.
+
+    .xlsx files are read with iter_xlsx_rows(), where progress.line_num follows the row numbers in the sheet;
+    anything else is read as CSV, see _open_report(). An open file object is read as CSV from where it is (see _open_stream())
+    & anything else that isn't a file name as rows in memory (see _iter_row_source()); neither can be read again, so progress
+    only counts their lines.
+
+    Yields:
+        (header, rows) - tuple; list of column names (None for an empty file) & an iterator of rows, each a list of strings.
+    """
+    if not is_path(this_file):
+        if hasattr(this_file, "read"):
+            with _open_stream(this_file) as (header, rows):
+                yield header, rows
+        else:
+            yield _iter_row_source(this_file)
+        return
+
+    this_file = os.fspath(this_file)
+    if this_file.lower().endswith(".xlsx"):
+        sheet = iter_xlsx_rows(this_file)
+        header = next(sheet, (None, None))[1]
+        def rows():
+            for row_num, row in sheet:
+                if row_num >= progress.line_num:
+                    progress.line_num = row_num
+                    yield row
+        try:
+            yield header, rows()
+        finally:
+            sheet.close()
+        return
+
+    with _open_report(this_file) as (infile, size):
+        if stop is None or (size is not None and size < stop):
+            stop = size
+        HEADER = infile.readline().decode(ENCODING)
+        header = HEADER.rstrip("\r\n").split(",") if HEADER else None
+        if progress.offset == 0:
+            progress.offset = infile.tell()
+        else:
+            infile.seek(progress.offset)
+        yield header, csv.reader(_read_lines(infile, progress, stop))
+
+def iter_report(this_file, compact=False, progress=None, extra_columns=(), stop=None, optional_columns=()):
+    """
+    Opens file specified by user & yields its rows one at a time, performing the same quality checks as load_report().
+
+    Args:
+        this_file - string; the file name provided by user through the command line. May be gzip, bz2, xz, or zip compressed, see _open_report(), or an .xlsx workbook.
+            An open file object or rows already in memory are read too, see _open_rows().
+        compact - boolean; yield ReportRow records instead of dictionaries.
+        progress - ReadProgress; start from where an earlier call stopped & keep it updated. Rows already read are skipped.
+        extra_columns - list; names of other columns to keep, e.g. "Permit ID". Kept in ReportRow.extra, or under their lower-cased names in dictionaries.
+        stop - int; only read a .csv report up to this byte offset, for reading it in parts. Checking for empty columns is then left to the caller, see parallel_values().
+        optional_columns - list; same as extra_columns (kept after them) for columns the report may not have; missing ones read as "".
+
+    Yields:
+        (line_num, line_dict_sub) - tuple; line number in this_file & the row's values for THESE_KEYS.
+    """
+    if progress is None:
+        progress = ReadProgress()
+
+    with _open_rows(this_file, progress, stop) as (header, reader):
+        name = source_name(this_file)
+        if header is None:
+            raise ValueError(f'\nERROR: {name} is empty.\n')
+        indices = _column_indices(header, name)
+        project = operator.itemgetter(*indices)
+        extra_indices = _column_indices(header, name, extra_columns)
+        positions = {entry.lower(): i for i, entry in enumerate(header)}
+        extra_indices += [positions.get(entry.lower(), -1) for entry in optional_columns] #* -1: not in this report
+        extra_keys = [entry.lower() for entry in list(extra_columns) + list(optional_columns)]
+        min_len = max(indices + extra_indices) + 1
+        missing = -1 in extra_indices
 
-        line_num = 2 #* to keep numbering consistent w csv file
-        reader = csv.reader(infile)
         for row in reader:
-            line_dict = dict(zip(HEADER_split, row))
-            line_dict_sub = {key:value for key,value in line_dict.items() if key in [entry.lower() for entry in THESE_KEYS]} #* only keep k-v if k is in THESE_COLS
-            this_file_dict[line_num] = line_dict_sub
-            line_num += 1
+            if len(row) < min_len:
+                row = row + [""] * (min_len - len(row)) #* short or blank line
+            values = project(row)
+            if progress.empty_cols:
+                progress.empty_cols = {i for i in progress.empty_cols if len(values[i]) == 0}
+            line_num = progress.line_num
+            progress.line_num += 1
+            if extra_indices:
+                if missing:
+                    extra = tuple([row[i] if i >= 0 else "" for i in extra_indices])
+                else:
+                    extra = tuple([row[i] for i in extra_indices])
+                if compact:
+                    yield line_num, ReportRow(*values, extra=extra)
+                else:
+                    yield line_num, dict(zip(THESE_KEYS_LOWER + extra_keys, values + extra))
+            elif compact:
+                yield line_num, ReportRow(*values)
+            else:
+                yield line_num, dict(zip(THESE_KEYS_LOWER, values))
 
         #* verify each col has at least one value in it
-        c = collections.Counter()
-        for row, entry in this_file_dict.items():
-            for k, v in entry.items():
-                if len(v)>0:
-                    c.update([k])
-        for entry in THESE_KEYS:
-            if c[entry.lower()]==0:
-                raise ValueError(f'\nERROR: No values found in "{entry}" column.\n')
+        if stop is None:
+            _check_empty_cols(progress.empty_cols)
 
-    return this_file_dict
+def _check_empty_cols(empty_cols):
+    for i, entry in enumerate(THESE_KEYS):
+        if i in empty_cols:
+            raise ValueError(f'\nERROR: No values found in "{entry}" column.\n')
 
-def get_values(dict_clean):
+def load_report(this_file, compact=False, clean=False, metrics=None):
     """
-    Retrieve the values for ammonia, temperature, and pH.
+    Opens file specified by user & performs some simple quality checks.
 
     Args:
-        dict_clean - dictionary; contains a cleaned & updated subset of values from original input file.
+        this_file - string; the file name provided by user through the command line.
+        compact - boolean; store each row as a ReportRow record instead of a dictionary, to save memory on large files.
+        clean - boolean; update each row with clean_row() as it is read, same result as check_clean(load_report(this_file)) without a second copy.
+        metrics - RunMetrics; record the read (& normalize, with clean) stages in it.
 
     Returns:
-        extracted_vals - dictionary; the values retrieved from dict_clean.
+        this_file_dict - dictionary; a cleaned, updated, & shortened dictionary based on this_file.
     """
 
-    dates_used = [] # To hold the dates for all temp. & pH data points used
-
-    dict_clean_sub = {}
-    for main_key, main_value in dict_clean.items(): # main_key is the row num, main_value is the row's entries as key-value pairs
-        if main_value["sample point description"] == "effluent gross value":
-            dict_clean_sub[main_key] = main_value
-
-    assert len(dict_clean_sub.keys()) > 0,'''\nERROR: No "Effluent Gross Value" entries found in 'Sample Point Description'. Please check file.\n'''
-
-    ######################## 
-    ## Temperature Values ##
-
-    temp_summer_list = [] #Jun to Sep; max 20 values
-    temp_winter_list = [] #Apr & Nov; max 10 values
-    for main_key, main_value in dict_clean_sub.items():
-        if (main_value["dmr parameter description abbrv."] == "temperature,  oc"): # previousl also filtered by 'concentrated average stat base'
-            if 6 <= main_value["mon. period start date"].month <= 9:
-                temp_summer_list.append(main_value)
-            elif (main_value["mon. period start date"].month == 4) or (main_value["mon. period start date"].month == 11):
-                temp_winter_list.append(main_value)
-    
-    temp_summer_list_sort = sorted(temp_summer_list, key=lambda x: x["mon. period start date"], reverse=True)
-    temp_winter_list_sort = sorted(temp_winter_list, key=lambda x: x["mon. period start date"], reverse=True)
-    temp_summer_values = [i["reported value concentration avg"] for i in temp_summer_list_sort][:20]
-    temp_summer_dates =  [i["mon. period start date"] for i in temp_summer_list_sort][:20]
-    dates_used.extend(temp_summer_dates)
-    temp_winter_values = [i["reported value concentration avg"] for i in temp_winter_list_sort][:10]
-    temp_winter_dates = [i["mon. period start date"] for i in temp_winter_list_sort][:10]
-    dates_used.extend(temp_winter_dates)
-    
-    ###############
-    ## pH Values ##
-
-    ph_summer_list = [] #May to Oct; max 30 values
-    ph_winter_list = [] #Nov to Apr; max 30 values
-    for main_key, main_value in dict_clean_sub.items():
-        if (main_value["dmr parameter description abbrv."] == "ph"): # previously also filtered by 'concentration maximum stat base'
-            if 5 <= main_value["mon. period start date"].month <= 10:
-                ph_summer_list.append(main_value)
-            elif (11 <= main_value["mon. period start date"].month <= 12) or (1 <= main_value["mon. period start date"].month <= 4):
-                ph_winter_list.append(main_value)
-
-    ph_summer_list_sort = sorted(ph_summer_list, key=lambda x: x["mon. period start date"], reverse=True)
-    ph_winter_list_sort = sorted(ph_winter_list, key=lambda x: x["mon. period start date"], reverse=True)
-    ph_summer_values = [i["reported value concentration max"] for i in ph_summer_list_sort][:30]
-    ph_summer_dates = [i["mon. period start date"] for i in ph_summer_list_sort][:30] # collect the dates related to the values captured
-    dates_used.extend(ph_summer_dates)
-    ph_winter_values = [i["reported value concentration max"] for i in ph_winter_list_sort][:30]
-    ph_winter_dates = [i["mon. period start date"] for i in ph_winter_list_sort][:30]
-    dates_used.extend(ph_winter_dates)
-
-    ####################
-    ## Ammonia Values ##
-
-    #chronic values
-    n_summer_chronic_list = [] #May to Oct; max 18 values
-    n_winter_chronic_list = [] #Nov to Apr; max 18 values
-    for main_key, main_value in dict_clean_sub.items():
-        if (main_value["dmr parameter description abbrv."] == "nitrogen, ammonia total (as n)"): #average = "chronic"; previously also filtered by 'concentrated average stat base'
-            if 5 <= main_value["mon. period start date"].month <= 10:
-                n_summer_chronic_list.append(main_value)
-            elif (11 <= main_value["mon. period start date"].month <= 12) or (1 <= main_value["mon. period start date"].month <= 4):
-                n_winter_chronic_list.append(main_value)
-
-    n_summer_chronic_list_sort = sorted(n_summer_chronic_list, key=lambda x: x["mon. period start date"], reverse=True)
-    n_winter_chronic_list_sort = sorted(n_winter_chronic_list, key=lambda x: x["mon. period start date"], reverse=True)
-    n_summer_chronic_values = [i["reported value concentration avg"] for i in n_summer_chronic_list_sort][:18]
-    n_summer_chronic_dates = [i["mon. period start date"] for i in n_summer_chronic_list_sort][:18]
-    dates_used.extend(n_summer_chronic_dates)
-    n_winter_chronic_values = [i["reported value concentration avg"] for i in n_winter_chronic_list_sort][:18]
-    n_winter_chronic_dates = [i["mon. period start date"] for i in n_winter_chronic_list_sort][:18]
-    dates_used.extend(n_winter_chronic_dates)
-    
-    n_summer_chronic_nums = []
-    for i in n_summer_chronic_values:
-        try:
-            n_summer_chronic_nums.append(float(i))
-        except:
-            n_summer_chronic_nums.append(0.0)
+    this_file_dict = {} #dictionary of dictionaries representing this_file; keys = line_num, values = dictionary
 
-    n_winter_chronic_nums = []
-    for i in n_winter_chronic_values:
-        try:
-            n_winter_chronic_nums.append(float(i))
-        except:
-            n_winter_chronic_nums.append(0.0)
-    
-    try:
-        n_summer_chronic_max = max(n_summer_chronic_nums)
-        n_winter_chronic_max = max(n_winter_chronic_nums)
-    except:
-        raise ValueError('\nERROR: Cannot find values for summer or winter chronic Ammonia.\n')
-
-    #acute values
-    n_summer_acute_list = [] #May to Oct; max 18 values
-    n_winter_acute_list = [] #Nov to Apr; max 18 values
-    for main_key, main_value in dict_clean_sub.items():
-        if (main_value["dmr parameter description abbrv."] == "nitrogen, ammonia total (as n)"): #max = "acute"; previously also filtered by 'concentration maximum stat base'
-            if 5 <= main_value["mon. period start date"].month <= 10:
-                n_summer_acute_list.append(main_value)
-            elif (11 <= main_value["mon. period start date"].month <= 12) or (1 <= main_value["mon. period start date"].month <= 4):
-                n_winter_acute_list.append(main_value)
-
-    n_summer_acute_list_sort = sorted(n_summer_acute_list, key=lambda x: x["mon. period start date"], reverse=True)
-    n_winter_acute_list_sort = sorted(n_winter_acute_list, key=lambda x: x["mon. period start date"], reverse=True)
-    n_summer_acute_values = [i["reported value concentration max"] for i in n_summer_acute_list_sort][:18]
-    n_summer_acute_dates = [i["mon. period start date"] for i in n_summer_acute_list_sort][:18]
-    dates_used.extend(n_summer_acute_dates)
-    n_winter_acute_values = [i["reported value concentration max"] for i in n_winter_acute_list_sort][:18]
-    n_winter_acute_dates = [i["mon. period start date"] for i in n_winter_acute_list_sort][:18]
-    dates_used.extend(n_winter_acute_dates)
-    
-    n_summer_acute_nums = []
-    for i in n_summer_acute_values:
-        try:
-            n_summer_acute_nums.append(float(i))
-        except:
-            n_summer_acute_nums.append(0.0)
+    rows = iter_report(this_file, compact=compact)
+    if metrics is not None:
+        rows = metrics.timed("read", rows)
+    if clean:
+        rows = iter_clean(rows, in_place=True, metrics=metrics)
 
-    n_winter_acute_nums = []
-    for i in n_winter_acute_values:
-        try:
-            n_winter_acute_nums.append(float(i))
-        except:
-            n_winter_acute_nums.append(0.0)
-    
-    n_summer_acute_max = max(n_summer_acute_nums)
-    n_winter_acute_max = max(n_winter_acute_nums)
+    for line_num, line_dict_sub in rows:
+        this_file_dict[line_num] = line_dict_sub
 
-    #####################
-    ### Process Dates ###
+    return this_file_dict
 
-    min_date = min(dates_used).date()
-    max_date = max(dates_used).date()
+def iter_clean(rows, in_place=False, metrics=None):
+    """
+    Update the rows yielded by iter_report() for processing as they stream past, see clean_row().
 
-    found_dates = {
-        "temp_summer_dates":temp_summer_dates,
-        "temp_winter_dates":temp_winter_dates,
-        "ph_summer_dates":ph_summer_dates,
-        "ph_winter_dates":ph_winter_dates,
-        "n_summer_chronic_dates":n_summer_chronic_dates,
-        "n_winter_chronic_dates":n_winter_chronic_dates,
-        "n_summer_acute_dates":n_summer_acute_dates,
-        "n_winter_acute_dates":n_winter_acute_dates
-        }
+    Args:
+        rows - iterable; (line_num, values_dict) tuples.
+        in_place - boolean; update each values_dict directly instead of a copy of it.
+        metrics - RunMetrics; record the normalize stage, the date formats, & the non-numeric values seen in it.
+            When rows come from RunMetrics.timed("read", ...), the time spent reading is not counted as normalizing.
 
-    dates_dict = {}
-    for name, var in found_dates.items():
-        this_name = name.split("_dates")[0]
+    Yields:
+        (line_num, values_dict) - tuple; values_dict updated by clean_row().
+    """
+    date_parser = StartDateParser() #* one per report, so the cache & format order follow this report
+    if metrics is not None:
+        yield from metrics.timed("normalize", _iter_clean_counted(rows, in_place, date_parser, metrics), inner="read")
+        return
 
-        for method_name, method in {"min":min, "max":max}.items():
-            try:
-                dates_dict[this_name+"_date_"+method_name] = method(var).date()
-            except:
-                dates_dict[this_name+"_date_"+method_name] = "N/A"
-        
-    # Gather all values
-    extracted_vals = {
-        "Earliest date": str(min_date),
-        "Most recent date": str(max_date),
-        "pH summer values": ph_summer_values,
-        "pH summer dates": (dates_dict["ph_summer_date_min"], dates_dict["ph_summer_date_max"]),
-        "pH winter values": ph_winter_values,
-        "pH winter dates": (dates_dict["ph_winter_date_min"], dates_dict["ph_winter_date_max"]),
-        "Temperature summer values": temp_summer_values,
-        "Temperature summer dates": (dates_dict["temp_summer_date_min"], dates_dict["temp_summer_date_max"]),
-        "Temperature winter values": temp_winter_values,
-        "Temperature winter dates": (dates_dict["temp_winter_date_min"], dates_dict["temp_winter_date_max"]),
-        "Ammonia summer acute max": n_summer_acute_max,
-        "Ammonia summer acute values": n_summer_acute_values,
-        "Ammonia summer acute dates": (dates_dict["n_summer_acute_date_min"], dates_dict["n_summer_acute_date_max"]),
-        "Ammonia summer chronic max": n_summer_chronic_max,
-        "Ammonia summer chronic values": n_summer_chronic_values,
-        "Ammonia summer chronic dates": (dates_dict["n_summer_chronic_date_min"], dates_dict["n_summer_chronic_date_max"]),
-        "Ammonia winter acute max": n_winter_acute_max,
-        "Ammonia winter acute values": n_winter_acute_values,
-        "Ammonia winter acute dates": (dates_dict["n_winter_acute_date_min"], dates_dict["n_winter_acute_date_max"]),
-        "Ammonia winter chronic max": n_winter_chronic_max,
-        "Ammonia winter chronic values": n_winter_chronic_values,
-        "Ammonia winter chronic dates": (dates_dict["n_winter_chronic_date_min"], dates_dict["n_winter_chronic_date_max"]),
-    }
+    for line_num, values_dict in rows:
+        if not in_place:
+            values_dict = values_dict.copy()
+        yield line_num, clean_row(values_dict, date_parser)
 
-    return extracted_vals
+def _iter_clean_counted(rows, in_place, date_parser, metrics):
+    """
+    Same as iter_clean(), also counting the date formats & non-numeric values seen into metrics.
+    """
+    raw_dates = {} #* one entry per distinct start date, i.e. about one per month
+    for line_num, values_dict in rows:
+        raw = values_dict["mon. period start date"]
+        raw_dates[raw] = raw_dates.get(raw, 0) + 1
+        for entry in VALUE_KEYS:
+            value = values_dict[entry]
+            flag = NUMERIC_PARSER.parse(value)[1]
+            if flag != "" and flag != "blank":
+                value = value.strip()
+                metrics.non_numeric[value] = metrics.non_numeric.get(value, 0) + 1
+        if not in_place:
+            values_dict = values_dict.copy()
+        yield line_num, clean_row(values_dict, date_parser)
 
-def export_values(found_values, orig_fname):
+    for raw, count in raw_dates.items():
+        shape = date_parser.shapes.get(raw, "blank" if len(raw) == 0 else "unknown")
+        metrics.date_formats[shape] = metrics.date_formats.get(shape, 0) + count
+
+METRICS_HOOKS = [] #functions called with RunMetrics.as_dict() after each profiled report, see add_metrics_hook()
+
+def add_metrics_hook(hook):
     """
-    Format & export the results to a .csv file.
+    Have hook(metrics) called with RunMetrics.as_dict() after each profiled report, e.g. to collect metrics across a batch.
 
     Args:
-        found_values - dictionary; values found & extracted from original input file.
-        orig_fname - string; name of the original input file.
+        hook - function; takes one dictionary. Called in the process that started the run, also for batch runs.
+    """
+    METRICS_HOOKS.append(hook)
 
-    Returns:
-        N/A - a file is created in the current working directory.
-    """
-    now = datetime.datetime.now()
-    stamp = f"{now.year}_{now.month}_{now.day}_{now.hour}{now.minute}"
-    filename = f"{stamp}_VALUES_FOR-{orig_fname}"
-
-    with open(filename, "w") as outfile:
-        outfile.write(f"Export of values from: {orig_fname}\n")
-        outfile.write(f"Dates used: {found_values['Earliest date']} to {found_values['Most recent date']}")
-        outfile.write("\n\n")
-
-        outfile.write("pH summer values")
-        outfile.write("\n")
-        outfile.write(f"Dates used: {found_values['pH summer dates'][0]} to {found_values['pH summer dates'][1]}")
-        counter = 1
-        for i in found_values["pH summer values"]:
-            outfile.write(f"\n,{counter}:,{i}")
-            counter += 1
-        outfile.write("\n\n")
-
-        outfile.write("pH winter values")
-        outfile.write("\n")
-        outfile.write(f"Dates used: {found_values['pH winter dates'][0]} to {found_values['pH winter dates'][1]}")
-        counter = 1
-        for i in found_values["pH winter values"]:
-            outfile.write(f"\n,{counter}:,{i}")
-            counter += 1
-        outfile.write("\n\n")
-
-        outfile.write("Temperature summer values")
-        outfile.write("\n")
-        outfile.write(f"Dates used: {found_values['Temperature summer dates'][0]} to {found_values['Temperature summer dates'][1]}")
-        counter = 1
-        for i in found_values["Temperature summer values"]:
-            outfile.write(f"\n,{counter}:,{i}")
-            counter += 1
-        outfile.write("\n\n")
-
-        outfile.write("Temperature winter values")
-        outfile.write("\n")
-        outfile.write(f"Dates used: {found_values['Temperature winter dates'][0]} to {found_values['Temperature winter dates'][1]}")
-        counter = 1
-        for i in found_values["Temperature winter values"]:
-            outfile.write(f"\n,{counter}:,{i}")
-            counter += 1
-        outfile.write("\n\n")
-
-        outfile.write(f"Ammonia summer acute max,{found_values['Ammonia summer acute max']},,{','.join(found_values['Ammonia summer acute values'])},,Dates used: {found_values['Ammonia summer acute dates'][0]} to {found_values['Ammonia summer acute dates'][1]}")
-        outfile.write("\n")
-        outfile.write(f"Ammonia summer chronic max,{found_values['Ammonia summer chronic max']},,{','.join(found_values['Ammonia summer chronic values'])},,Dates used: {found_values['Ammonia summer chronic dates'][0]} to {found_values['Ammonia summer chronic dates'][1]}")
-        outfile.write("\n")
-        outfile.write(f"Ammonia winter acute max,{found_values['Ammonia winter acute max']},,{','.join(found_values['Ammonia winter acute values'])},,Dates used: {found_values['Ammonia winter acute dates'][0]} to {found_values['Ammonia winter acute dates'][1]}")
-        outfile.write("\n")
-        outfile.write(f"Ammonia winter chronic max,{found_values['Ammonia winter chronic max']},,{','.join(found_values['Ammonia winter chronic values'])},,Dates used: {found_values['Ammonia winter chronic dates'][0]} to {found_values['Ammonia winter chronic dates'][1]}")
-
-    assert os.path.exists(filename),"\nERROR: Could not create output file. Please check original file for possible issues.\n"
+def _call_metrics_hooks(metrics_dict):
+    for hook in METRICS_HOOKS:
+        hook(metrics_dict)
 
-if __name__ == "__main__":
+class RunMetrics:
+    """
+    Wall time & row counts for each stage of a run, peak traced memory for each step, & the date formats & non-numeric values seen.
+
+    Stages (read, normalize, filter, bucket, export) run interleaved row by row, so memory is traced per step instead:
+    the blocks wrapped in step(), e.g. "load_report" & "get_values", or "stream_values" & "export_values".
+    """
+
+    STAGES = ["read", "normalize", "filter", "bucket", "export"]
+
+    def __init__(self, this_file="", trace_memory=True):
+        """
+        Args:
+            this_file - string; the report being run, for the record.
+            trace_memory - boolean; trace peak memory with tracemalloc during step(). Makes steps a few times slower.
+        """
+        self.this_file = this_file
+        self.trace_memory = trace_memory
+        self.stages = {name: {"seconds": 0.0, "rows_in": 0, "rows_out": 0} for name in self.STAGES}
+        self.steps = {}
+        self.inner = {} #* stage: stage whose time is included in it
+        self.date_formats = {}
+        self.non_numeric = {}
+        self.duplicates = {} #* DuplicateFilter.counts, when one is used
 
-    if len(sys.argv) == 2:
+    @contextlib.contextmanager
+    def step(self, name):
+        """
+        Time the block of code in a `with` statement & trace its peak memory. A step named after a stage also counts toward that stage.
+        """
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
         try:
-            fname = sys.argv[1]
-            export_values(get_values(check_clean(load_report(fname))), orig_fname=fname)
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 3) if self.trace_memory else None
+            if started:
+                tracemalloc.stop()
+            self.steps[name] = {"seconds": round(seconds, 4), "peak_mb": peak_mb}
+            if name in self.stages:
+                self.stages[name]["seconds"] += seconds
+
+    def timed(self, name, rows, inner=None):
+        """
+        Yield from rows, adding the time spent getting each one to stage `name` & counting them as its rows out.
+
+        Args:
+            name - string; one of STAGES.
+            rows - iterable; the rows coming out of the stage.
+            inner - string; stage that rows itself reads from, whose time is taken back out of this one.
+        """
+        if inner is not None:
+            self.inner[name] = inner
+        stage = self.stages[name]
+        rows = iter(rows)
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                stage["seconds"] += time.perf_counter() - start
+                return
+            stage["seconds"] += time.perf_counter() - start
+            stage["rows_out"] += 1
+            yield row
+
+    def as_dict(self):
+        """
+        Returns:
+            metrics - dictionary; file, steps, stages (with rows per second), date formats, non-numeric values seen, & duplicate counts.
+        """
+        stages = {}
+        rows_in = None
+        for name in self.STAGES:
+            stage = dict(self.stages[name])
+            if name in self.inner:
+                stage["seconds"] -= self.stages[self.inner[name]]["seconds"]
+            if name in ("read", "normalize"):
+                stage["rows_in"] = stage["rows_out"] if rows_in is None else rows_in
+                rows_in = stage["rows_out"]
+            stage["seconds"] = round(max(stage["seconds"], 0.0), 4)
+            stage["rows_per_s"] = round(stage["rows_in"] / stage["seconds"]) if stage["seconds"] > 0 else None
+            stages[name] = stage
+
+        return {
+            "file": self.this_file,
+            "steps": self.steps,
+            "stages": stages,
+            "date_formats": dict(self.date_formats),
+            "non_numeric": dict(sorted(self.non_numeric.items(), key=lambda x: -x[1])),
+            "duplicates": dict(self.duplicates),
+        }
+
+    def report(self, outfile=None):
+        """
+        Print the metrics as a table, to stderr by default.
+        """
+        outfile = outfile or sys.stderr
+        metrics = self.as_dict()
+        print(f"Metrics for: {metrics['file']}", file=outfile)
+        print(f"{'stage':<12}{'seconds':>10}{'rows in':>12}{'rows out':>12}{'rows/s':>12}", file=outfile)
+        for name, stage in metrics["stages"].items():
+            print(f"{name:<12}{stage['seconds']:>10.4f}{stage['rows_in']:>12}{stage['rows_out']:>12}{stage['rows_per_s'] or '':>12}", file=outfile)
+        for name, step in metrics["steps"].items():
+            peak = "" if step["peak_mb"] is None else f", peak {step['peak_mb']} MB"
+            print(f"step {name}: {step['seconds']} s{peak}", file=outfile)
+        print(f"date formats: {metrics['date_formats']}", file=outfile)
+        print(f"non-numeric values: {dict(list(metrics['non_numeric'].items())[:10])}", file=outfile)
+        if metrics["duplicates"]:
+            print(f"duplicates: {metrics['duplicates']}", file=outfile)
+
+    def write_json(self, fname):
+        """
+        Write the metrics to a JSON file, e.g. next to the exported values.
+        """
+        with open(fname, "w") as outfile:
+            json.dump(self.as_dict(), outfile, indent=2)
+
+SAMPLE_POINT = "effluent gross value" #only rows for this sample point are used by default
+
+SUMMER = (5, 6, 7, 8, 9, 10) #May to Oct
+WINTER = (11, 12, 1, 2, 3, 4) #Nov to Apr
+
+#what get_values() retrieves; each bucket keeps the `size` most recent values of `parameter` from rows in `months`,
+#read from the rule's `column` unless the bucket has its own
+#results are named after each bucket's label: "<label> values", "<label> dates", & "<label> max" when "max" is set
+EXTRACTION_RULES = [
+    {
+        "parameter": "ph", # previously also filtered by 'concentration maximum stat base'
+        "column": "reported value concentration max",
+        "buckets": [
+            {"label": "pH summer", "months": SUMMER, "size": 30},
+            {"label": "pH winter", "months": WINTER, "size": 30},
+        ],
+    },
+    {
+        "parameter": "temperature,  oc", # previously also filtered by 'concentrated average stat base'
+        "column": "reported value concentration avg",
+        "buckets": [
+            {"label": "Temperature summer", "months": (6, 7, 8, 9), "size": 20}, #Jun to Sep
+            {"label": "Temperature winter", "months": (4, 11), "size": 10}, #Apr & Nov
+        ],
+    },
+    {
+        "parameter": "nitrogen, ammonia total (as n)",
+        "max": True,
+        "buckets": [
+            #max = "acute"; previously also filtered by 'concentration maximum stat base'
+            #average = "chronic"; previously also filtered by 'concentrated average stat base'
+            {"label": "Ammonia summer acute", "months": SUMMER, "size": 18, "column": "reported value concentration max"},
+            {"label": "Ammonia summer chronic", "months": SUMMER, "size": 18, "column": "reported value concentration avg"},
+            {"label": "Ammonia winter acute", "months": WINTER, "size": 18, "column": "reported value concentration max"},
+            {"label": "Ammonia winter chronic", "months": WINTER, "size": 18, "column": "reported value concentration avg"},
+        ],
+    },
+]
+
+def compile_rules(rules):
+    """
+    Turn extraction rules into a lookup from (parameter, month) to the buckets a row belongs in, so all rules are filled in one pass.
+
+    Args:
+        rules - list; of dictionaries, see EXTRACTION_RULES.
+
+    Returns:
+        dispatch - dictionary; keys = parameter, values = list indexed by month of ((label, column), ...) tuples.
+        sizes - dictionary; keys = bucket label, values = number of values kept.
+    """
+    dispatch = {}
+    sizes = {}
+    for rule in rules:
+        by_month = dispatch.setdefault(rule["parameter"], [()] * 13)
+        for bucket in rule["buckets"]:
+            if bucket["label"] in sizes:
+                raise ValueError(f'\nERROR: Bucket label "{bucket["label"]}" is used by more than one rule.\n')
+            sizes[bucket["label"]] = bucket["size"]
+            for month in bucket["months"]:
+                by_month[month] = by_month[month] + ((bucket["label"], bucket.get("column", rule.get("column"))),)
+
+    return dispatch, sizes
+
+def get_values(dict_clean, rules=EXTRACTION_RULES, metrics=None):
+    """
+    Retrieve the values for ammonia, temperature, and pH.
+
+    Args:
+        dict_clean - dictionary; contains a cleaned & updated subset of values from original input file.
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        metrics - RunMetrics; record the filter & bucket stages in it.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved from dict_clean.
+    """
+    stream = ValueStream(rules)
+    stream.feed(enumerate(dict_clean.values()), metrics) #* position in dict_clean breaks ties on date
+
+    return stream.result()
+
+def _gather_values(found, rules, maxes=None):
+    """
+    Gather the values & dates retrieved for each bucket into the results of get_values().
+
+    Args:
+        found - dictionary; keys = bucket label, values = list of (date, value) tuples, most recent first.
+        rules - list; the rules the buckets came from, see EXTRACTION_RULES.
+        maxes - dictionary; keys = bucket label, values = max of its values, when already known (see AsOfStream). Others are worked out here.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved for each bucket.
+    """
+
+    dates_used = [] # To hold the dates for all data points used
+    maxes = dict(maxes or {})
+    for rule in rules:
+        for bucket in rule["buckets"]:
+            label = bucket["label"]
+            dates_used.extend(date for date, _ in found[label])
+            if rule.get("max"):
+                if len(found[label]) == 0:
+                    raise ValueError(f'\nERROR: Cannot find values for {label}.\n')
+                if label not in maxes:
+                    maxes[label] = max(_max_numbers([value for _, value in found[label]]))
+
+    #####################
+    ### Process Dates ###
+
+    min_date = min(dates_used).date()
+    max_date = max(dates_used).date()
+
+    # Gather all values
+    extracted_vals = {
+        "Earliest date": str(min_date),
+        "Most recent date": str(max_date),
+    }
+    for rule in rules:
+        for bucket in rule["buckets"]:
+            label = bucket["label"]
+            dates = [date for date, _ in found[label]]
+            if label in maxes:
+                extracted_vals[f"{label} max"] = maxes[label]
+            extracted_vals[f"{label} values"] = [value for _, value in found[label]]
+            if dates:
+                extracted_vals[f"{label} dates"] = (min(dates).date(), max(dates).date())
+            else:
+                extracted_vals[f"{label} dates"] = ("N/A", "N/A")
+
+    return extracted_vals
+
+class MostRecent:
+    """
+    Fixed-size bucket holding only the `size` most recent values added to it.
+
+    Ties on date keep the row that came first in the file, same as sorting a full list by date with reverse=True.
+    """
+
+    __slots__ = ("size", "heap")
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = [] #* min-heap of (date, -line_num, value); heap[0] is the entry to drop next
+
+    def add(self, date, line_num, value):
+        entry = (date, -line_num, value)
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def entries(self):
+        """
+        Returns:
+            list of (date, value) tuples; most recent first.
+        """
+        return [(date, value) for date, _, value in sorted(self.heap, reverse=True)]
+
+class ValueStream:
+    """
+    Retrieve the values for ammonia, temperature, and pH from rows fed one at a time.
+
+    Memory depends on the bucket sizes, not on the number of rows fed.
+    """
+
+    def __init__(self, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT):
+        """
+        Args:
+            rules - list; what to retrieve, see EXTRACTION_RULES.
+            sample_point - string; only rows with this (cleaned) "Sample Point Description" are used. None uses every row.
+        """
+        self.rules = rules
+        self.sample_point = sample_point
+        self.dispatch, sizes = compile_rules(rules)
+        self.buckets = {label: MostRecent(size) for label, size in sizes.items()}
+        self.effluent_rows = 0
+
+    def _keep(self, values_dict):
+        if self.sample_point is None:
+            return True
+        if type(values_dict) is ReportRow:
+            return values_dict.sample_point == self.sample_point
+        return values_dict["sample point description"] == self.sample_point
+
+    def _bucket(self, line_num, values_dict):
+        """
+        Put a row kept by _keep() into its buckets. Returns True if there were any.
+        """
+        if type(values_dict) is ReportRow:
+            parameter = values_dict.parameter
+        else:
+            parameter = values_dict["dmr parameter description abbrv."]
+        by_month = self.dispatch.get(parameter)
+        if by_month is None:
+            return False
+
+        date = values_dict["mon. period start date"]
+        targets = by_month[date.month]
+        for label, column in targets:
+            self.buckets[label].add(date, line_num, values_dict[column])
+
+        return len(targets) > 0
+
+    def add(self, line_num, values_dict):
+        """
+        Args:
+            line_num - int; line number of the row in the original input file.
+            values_dict - dictionary or ReportRow; one row updated by clean_row().
+        """
+        if self._keep(values_dict):
+            self.effluent_rows += 1
+            self._bucket(line_num, values_dict)
+
+    def feed(self, rows, metrics=None):
+        """
+        add() every row.
+
+        Args:
+            rows - iterable; (line_num, values_dict) tuples.
+            metrics - RunMetrics; record the filter & bucket stages in it.
+        """
+        if metrics is None:
+            for line_num, values_dict in rows:
+                self.add(line_num, values_dict)
+            return
+
+        filter_stage = metrics.stages["filter"]
+        bucket_stage = metrics.stages["bucket"]
+        for line_num, values_dict in rows:
+            start = time.perf_counter()
+            filter_stage["rows_in"] += 1
+            kept = self._keep(values_dict)
+            middle = time.perf_counter()
+            filter_stage["seconds"] += middle - start
+            if kept:
+                self.effluent_rows += 1
+                filter_stage["rows_out"] += 1
+                bucket_stage["rows_in"] += 1
+                if self._bucket(line_num, values_dict):
+                    bucket_stage["rows_out"] += 1
+                bucket_stage["seconds"] += time.perf_counter() - middle
+
+    def _check_entries(self, effluent_rows):
+        if self.sample_point is None:
+            assert effluent_rows > 0,'''\nERROR: No entries found. Please check file.\n'''
+        else:
+            assert effluent_rows > 0,f'''\nERROR: No "{self.sample_point.title()}" entries found in 'Sample Point Description'. Please check file.\n'''
+
+    def result(self):
+        """
+        Returns:
+            extracted_vals - dictionary; same as get_values() for all rows fed so far.
+        """
+        self._check_entries(self.effluent_rows)
+
+        return _gather_values({label: bucket.entries() for label, bucket in self.buckets.items()}, self.rules)
+
+#columns repeated by a re-submitted monitoring period, see DuplicateFilter
+DEDUP_KEYS = ["Sample Point Description", "DMR Parameter Description Abbrv.", "Mon. Period Start Date"]
+OUTFALL_COLUMNS = ["Outfall", "Perm Feature ID", "Perm Feature Nmbr"] #* names reports use for the outfall a row was sampled at
+DEDUP_OPTIONAL_KEYS = ["Permit ID"] + OUTFALL_COLUMNS #* part of the key when the report has them, so permits & outfalls reporting the same dates aren't duplicates of each other
+DEDUP_POLICIES = ("first", "last", "flag")
+
+class DuplicateFilter:
+    """
+    Drop or flag rows repeating the key columns of another row, remembering a 64-bit hash of each key instead of the rows.
+
+    keep="first" & keep="flag" work in the same pass that reads the rows. keep="last" can't tell a row is repeated further down
+    until it gets there, so scan() has to go over the same rows first, remembering the last line of each key.
+    """
+
+    MAX_FLAGGED = 1000 #* (line_num, line_num of first row with the same key) pairs kept with keep="flag"
+
+    def __init__(self, keep="first", key_columns=DEDUP_KEYS, optional_columns=DEDUP_OPTIONAL_KEYS):
+        """
+        Args:
+            keep - string; "first" or "last" keeps that row of each key & drops the others, "flag" keeps all rows & records the repeats.
+            key_columns - list; names of the columns that make rows duplicates, any case. Columns besides THESE_KEYS are read as extra columns.
+            optional_columns - list; more key columns, only used when the report has them.
+        """
+        if keep not in DEDUP_POLICIES:
+            raise ValueError(f"\nERROR: Unknown duplicate policy {keep!r}, expected one of: {', '.join(DEDUP_POLICIES)}.\n")
+        self.keep = keep
+        self.key_columns = []
+        self.extra_columns = []
+        self.optional_columns = []
+        self.add_key_columns(key_columns)
+        for entry in optional_columns:
+            if entry.lower() not in self.key_columns:
+                self.key_columns.append(entry.lower())
+                self.optional_columns.append(entry)
+        self.seen = {} #* hash of key: first line with it, or last line with keep="last"
+        self.counts = {"rows": 0, "duplicates": 0, "dropped": 0}
+        self.flagged = []
+
+    def add_key_columns(self, columns):
+        """
+        Make these columns part of the key too, e.g. the columns a report is partitioned by. The report must have them.
+        """
+        for entry in columns:
+            name = entry.lower()
+            if name not in self.key_columns:
+                self.key_columns.append(name)
+            self.optional_columns = [other for other in self.optional_columns if other.lower() != name]
+            if name not in THESE_KEYS_LOWER and name not in [other.lower() for other in self.extra_columns]:
+                self.extra_columns.append(entry)
+
+    def read_columns(self, extra_columns=()):
+        """
+        Columns to read for the keys, see iter_report().
+
+        Args:
+            extra_columns - list; other columns the caller reads, kept first.
+
+        Returns:
+            (extra_columns, optional_columns) - tuple; extra_columns with the key columns the report must have added, & the optional key columns.
+        """
+        taken = {entry.lower() for entry in extra_columns}
+        required = list(extra_columns) + [entry for entry in self.extra_columns if entry.lower() not in taken]
+        taken.update(entry.lower() for entry in required)
+
+        return required, [entry for entry in self.optional_columns if entry.lower() not in taken]
+
+    def _plan(self, extra_columns):
+        """
+        How to get the key of a row: getters for the key columns in THESE_KEYS, & positions in ReportRow.extra of the others.
+        """
+        extra_keys = [entry.lower() for entry in extra_columns]
+        core = [name for name in self.key_columns if name in THESE_KEYS_LOWER]
+        extra = [extra_keys.index(name) for name in self.key_columns if name not in THESE_KEYS_LOWER]
+        get_attrs = operator.attrgetter(*[ReportRow.FIELDS[name] for name in core]) if core else (lambda row: ())
+        get_items = operator.itemgetter(*core) if core else (lambda row: ())
+        other_keys = [name for name in self.key_columns if name not in THESE_KEYS_LOWER]
+        return get_attrs, get_items, extra, other_keys
+
+    def _digest(self, row, plan):
+        get_attrs, get_items, extra, other_keys = plan
+        if type(row) is ReportRow:
+            if extra:
+                return hash((get_attrs(row), tuple([row.extra[i].strip() for i in extra])))
+            return hash(get_attrs(row))
+        return hash((get_items(row), tuple([row[name].strip() for name in other_keys])))
+
+    def scan(self, rows, extra_columns=()):
+        """
+        Remember the last line of each key, for keep="last".
+
+        Args:
+            rows - iterable; (line_num, values_dict) tuples, the same ones later given to filter().
+            extra_columns - list; names of the values in ReportRow.extra, see read_columns() & iter_report().
+        """
+        plan = self._plan(extra_columns)
+        for line_num, values_dict in rows:
+            self.seen[self._digest(values_dict, plan)] = line_num
+
+    def filter(self, rows, extra_columns=()):
+        """
+        Yield the rows kept, counting what was repeated & dropped in self.counts.
+
+        Args:
+            rows - iterable; (line_num, values_dict) tuples updated by clean_row().
+            extra_columns - list; names of the values in ReportRow.extra, see read_columns() & iter_report().
+
+        Yields:
+            (line_num, values_dict) - tuple; rows kept.
+        """
+        plan = self._plan(extra_columns)
+        counts = self.counts
+        for line_num, values_dict in rows:
+            counts["rows"] += 1
+            digest = self._digest(values_dict, plan)
+            if self.keep == "last":
+                kept_line = self.seen.get(digest, line_num)
+            else:
+                kept_line = self.seen.setdefault(digest, line_num)
+            if kept_line != line_num:
+                counts["duplicates"] += 1
+                if self.keep != "flag":
+                    counts["dropped"] += 1
+                    continue
+                if len(self.flagged) < self.MAX_FLAGGED:
+                    self.flagged.append((line_num, kept_line))
+            yield line_num, values_dict
+
+def _iter_clean_report(this_file, progress=None, extra_columns=(), metrics=None, dedup=None):
+    """
+    Stream the rows of a report as cleaned ReportRow records, see iter_report() & iter_clean(). Records the read & normalize stages in metrics.
+    With dedup, a DuplicateFilter, its key columns are added after extra_columns & repeated rows are dropped or flagged.
+    """
+    optional_columns = ()
+    if dedup is not None:
+        extra_columns, optional_columns = dedup.read_columns(extra_columns)
+        if dedup.keep == "last":
+            dedup.scan(iter_clean(iter_report(this_file, compact=True, extra_columns=extra_columns, optional_columns=optional_columns), in_place=True), extra_columns + optional_columns)
+
+    rows = iter_report(this_file, compact=True, progress=progress, extra_columns=extra_columns, optional_columns=optional_columns)
+    if metrics is not None:
+        rows = metrics.timed("read", rows)
+    rows = iter_clean(rows, in_place=True, metrics=metrics)
+
+    if dedup is not None:
+        if metrics is not None:
+            metrics.duplicates = dedup.counts
+        rows = dedup.filter(rows, list(extra_columns) + list(optional_columns))
+
+    return rows
+
+def stream_values(this_file, rules=EXTRACTION_RULES, metrics=None, dedup=None):
+    """
+    Retrieve the values for ammonia, temperature, and pH from a report file in a single streaming pass.
+
+    Same results as get_values(check_clean(load_report(this_file))), without holding the whole file in memory.
+
+    Args:
+        this_file - string; the file name provided by user through the command line.
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        metrics - RunMetrics; record each stage in it.
+        dedup - DuplicateFilter; drop or flag repeated rows before they reach the buckets.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved from this_file.
+    """
+    stream = ValueStream(rules)
+    stream.feed(_iter_clean_report(this_file, metrics=metrics, dedup=dedup), metrics)
+
+    return stream.result()
+
+def partition_values(this_file, key_columns, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT, metrics=None, dedup=None):
+    """
+    Retrieve the values separately for each permit, outfall, sample point, etc. in a report, in a single streaming pass.
+
+    Memory depends on the number of partitions & the bucket sizes, not on the number of rows.
+
+    Args:
+        this_file - string; the file name provided by user through the command line.
+        key_columns - list; names of the columns whose values split the report into partitions, e.g. ["Permit ID", "Outfall"].
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        sample_point - string; see ValueStream. Use None when partitioning by "Sample Point Description".
+        metrics - RunMetrics; record the read & normalize stages in it. Filter & bucket aren't split out per partition.
+        dedup - DuplicateFilter; drop or flag repeated rows. key_columns are added to its key columns, so rows are only repeats within a partition.
+
+    Returns:
+        results - dictionary; keys = tuple of key_columns values, values = extracted_vals same as stream_values() for that partition.
+        failed - dictionary; keys = tuple of key_columns values, values = error message for partitions without usable values.
+    """
+    if len(key_columns) == 0:
+        raise ValueError("\nERROR: Please enter at least one column to partition by.\n")
+
+    if dedup is not None:
+        dedup.add_key_columns(key_columns)
+
+    streams = {}
+    n = len(key_columns)
+    for line_num, values_dict in _iter_clean_report(this_file, extra_columns=key_columns, metrics=metrics, dedup=dedup):
+        key = tuple([value.strip() for value in values_dict.extra[:n]])
+        stream = streams.get(key)
+        if stream is None:
+            stream = streams[key] = ValueStream(rules, sample_point)
+        stream.add(line_num, values_dict)
+
+    results = {}
+    failed = {}
+    for key, stream in streams.items():
+        try:
+            results[key] = stream.result()
+        except (AssertionError, ValueError) as e:
+            failed[key] = " ".join(str(e).split())
+
+    return results, failed
+
+def partition_fname(orig_fname, key):
+    """
+    Name a partition of a report after the report & its key, for export_values().
+
+    Args:
+        orig_fname - string; name of the original input file.
+        key - tuple; values of the partition's key columns.
+
+    Returns:
+        string; e.g. "report__WA0000001_001.csv" for orig_fname "report.csv".
+    """
+    label = "_".join(re.sub(r"[^\w.-]+", "-", part).strip("-") or "blank" for part in key)
+    return f"{report_stem(orig_fname)}__{label}.csv"
+
+def month_ends(first, last):
+    """
+    Args:
+        first - string; first month, "YYYY-MM".
+        last - string; last month, "YYYY-MM".
+
+    Returns:
+        cutoffs - list; the last day of each month from first to last, as datetime.date.
+    """
+    year, month = (int(part) for part in first.split("-"))
+    last_year, last_month = (int(part) for part in last.split("-"))
+    cutoffs = []
+    while (year, month) <= (last_year, last_month):
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        cutoffs.append(datetime.date(year, month, 1) - datetime.timedelta(days=1))
+
+    return cutoffs
+
+def parse_cutoffs(specs):
+    """
+    Read the cutoff dates given through the command line.
+
+    Args:
+        specs - list; of strings, each a date ("2016-12-31") or a range of months ("2014-01..2023-12") standing for each month's last day.
+
+    Returns:
+        cutoffs - list; sorted datetime.date values, without repeats.
+    """
+    cutoffs = set()
+    for spec in specs:
+        try:
+            if ".." in spec:
+                cutoffs.update(month_ends(*spec.split("..")))
+            else:
+                cutoffs.add(datetime.date.fromisoformat(spec))
+        except (TypeError, ValueError):
+            raise ValueError(f'\nERROR: Cannot read cutoff "{spec}"; use YYYY-MM-DD or YYYY-MM..YYYY-MM.\n')
+
+    return sorted(cutoffs)
+
+class BucketHistory:
+    """
+    Every value added to a bucket, for AsOfStream; same add() as MostRecent.
+    """
+
+    __slots__ = ("entries",)
+
+    def __init__(self):
+        self.entries = [] #* (date, -line_num, value), sorted by AsOfStream.results()
+
+    def add(self, date, line_num, value):
+        self.entries.append((date, -line_num, value))
+
+class AsOfStream(ValueStream):
+    """
+    Retrieve the values for ammonia, temperature, and pH as they would have been on each of many cutoff dates, from rows fed once.
+
+    Each bucket keeps every value fed to it & is sorted once; the cutoffs then slide over it in date order, so the window &
+    max for each cutoff come from the one before it instead of from a new pass over the report. Memory depends on the number
+    of rows in buckets, not on the number of cutoffs.
+    """
+
+    def __init__(self, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT):
+        super().__init__(rules, sample_point)
+        self.sizes = {label: bucket.size for label, bucket in self.buckets.items()}
+        self.max_labels = {bucket["label"] for rule in rules if rule.get("max") for bucket in rule["buckets"]}
+        self.buckets = {label: BucketHistory() for label in self.buckets}
+        self.effluent_dates = []
+
+    def add(self, line_num, values_dict):
+        if self._keep(values_dict):
+            self.effluent_rows += 1
+            self.effluent_dates.append(values_dict["mon. period start date"])
+            self._bucket(line_num, values_dict)
+
+    def _windows(self, label, limits):
+        """
+        Yield the window & max of one bucket for each limit, in increasing order.
+
+        A window holds the most recent `size` entries dated on or before the limit, most recent first. Both of its ends only move
+        forward, so the max comes from a deque of entries in decreasing order of value, each pushed & popped at most once.
+        Buckets whose rule has no "max" get None.
+        """
+        entries = self.buckets[label].entries
+        entries.sort() #* ties on date: later lines first, so the window keeps the earlier lines, same as MostRecent
+        dates = [entry[0] for entry in entries]
+        nums = _max_numbers([value for _, _, value in entries]) if label in self.max_labels else []
+        size = self.sizes[label]
+        best = collections.deque() #* indices into entries; their nums decrease from left to right
+        end = 0
+        for limit in limits:
+            stop = bisect.bisect_right(dates, limit)
+            start = max(0, stop - size)
+            window = [(date, value) for date, _, value in reversed(entries[start:stop])]
+            if not nums:
+                yield window, None
+                continue
+            for i in range(end, stop):
+                while best and nums[best[-1]] <= nums[i]:
+                    best.pop()
+                best.append(i)
+            end = stop
+            while best and best[0] < start:
+                best.popleft()
+            yield window, nums[best[0]] if best else None
+
+    def results(self, cutoffs):
+        """
+        Args:
+            cutoffs - list; datetime.date values. Rows with a "Mon. Period Start Date" after a cutoff are left out of its results.
+
+        Returns:
+            results - dictionary; keys = cutoff, values = extracted_vals same as get_values() on the rows up to that cutoff.
+            failed - dictionary; keys = cutoff, values = error message for cutoffs without usable values.
+        """
+        cutoffs = sorted(set(cutoffs))
+        limits = [datetime.datetime.combine(cutoff, datetime.time.max) for cutoff in cutoffs]
+        effluent_dates = sorted(date for date in self.effluent_dates if date is not None)
+        windows = {label: self._windows(label, limits) for label in self.buckets}
+
+        results = {}
+        failed = {}
+        for cutoff, limit in zip(cutoffs, limits):
+            found = {}
+            maxes = {}
+            for label, label_windows in windows.items():
+                found[label], most = next(label_windows)
+                if most is not None:
+                    maxes[label] = most
+            try:
+                self._check_entries(bisect.bisect_right(effluent_dates, limit))
+                results[cutoff] = _gather_values(found, self.rules, maxes)
+            except (AssertionError, ValueError) as e:
+                failed[cutoff] = " ".join(str(e).split())
+
+        return results, failed
+
+def as_of_values(this_file, cutoffs, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT, metrics=None, dedup=None):
+    """
+    Retrieve the values as they would have been on each cutoff date, in a single streaming pass, see AsOfStream.
+
+    Same results as stream_values() on a copy of the report cut down to the rows dated on or before each cutoff.
+
+    Args:
+        this_file - string; the file name provided by user through the command line.
+        cutoffs - list; datetime.date values, e.g. from month_ends().
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        sample_point - string; see ValueStream.
+        metrics - RunMetrics; record the read & normalize stages in it.
+        dedup - DuplicateFilter; drop or flag repeated rows, across the whole report.
+
+    Returns:
+        results - dictionary; keys = cutoff, values = extracted_vals same as stream_values() for the rows up to that cutoff.
+        failed - dictionary; keys = cutoff, values = error message for cutoffs without usable values.
+    """
+    if len(cutoffs) == 0:
+        raise ValueError("\nERROR: Please enter at least one cutoff date.\n")
+
+    stream = AsOfStream(rules, sample_point)
+    for line_num, values_dict in _iter_clean_report(this_file, metrics=metrics, dedup=dedup):
+        stream.add(line_num, values_dict)
+
+    return stream.results(cutoffs)
+
+class BucketValues:
+    """
+    Values retrieved for one bucket by extract(), most recent first.
+
+    `values` are floats parsed by NumericParser, with `flags` telling measured values from non-detects & the rest: "<0.1" is 0.1
+    flagged "<", & blanks, "ND", etc. are None. `raw_values` keeps what the report holds & `dates` the "Mon. Period Start Date" of each value.
+    """
+
+    __slots__ = ("label", "values", "flags", "raw_values", "dates", "max")
+
+    def __init__(self, label, values, flags, raw_values, dates, max=None):
+        self.label = label
+        self.values = values
+        self.flags = flags
+        self.raw_values = raw_values
+        self.dates = dates
+        self.max = max #* None for buckets whose rule has no "max"; anything but a measured value counts as 0.0, as in get_values()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        if not isinstance(other, BucketValues):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"BucketValues({self.label!r}, {len(self.values)} values, max={self.max!r})"
+
+    @property
+    def first_date(self):
+        return min(self.dates) if self.dates else None
+
+    @property
+    def last_date(self):
+        return max(self.dates) if self.dates else None
+
+    def stats(self, percentiles=STATS_PERCENTILES, non_detect="limit", engine=None):
+        """
+        Returns:
+            stats - dictionary; see value_stats().
+        """
+        return numeric_stats(self.values, self.flags, percentiles, non_detect, engine)
+
+class ExtractResult:
+    """
+    Everything extract() retrieved from one report: the dates covered & a BucketValues per bucket, by label.
+    """
+
+    __slots__ = ("source", "earliest_date", "most_recent_date", "buckets")
+
+    def __init__(self, source, earliest_date, most_recent_date, buckets):
+        self.source = source
+        self.earliest_date = earliest_date
+        self.most_recent_date = most_recent_date
+        self.buckets = buckets
+
+    def __getitem__(self, label):
+        return self.buckets[label]
+
+    def __iter__(self):
+        return iter(self.buckets.values())
+
+    def __repr__(self):
+        return f"ExtractResult({self.source!r}, {self.earliest_date} to {self.most_recent_date}, {len(self.buckets)} buckets)"
+
+    def as_dict(self):
+        """
+        Returns:
+            extracted_vals - dictionary; same as get_values(), e.g. for export_values().
+        """
+        extracted_vals = {
+            "Earliest date": str(self.earliest_date),
+            "Most recent date": str(self.most_recent_date),
+        }
+        for bucket in self.buckets.values():
+            if bucket.max is not None:
+                extracted_vals[f"{bucket.label} max"] = bucket.max
+            extracted_vals[f"{bucket.label} values"] = list(bucket.raw_values)
+            extracted_vals[f"{bucket.label} dates"] = (bucket.first_date, bucket.last_date) if bucket.dates else ("N/A", "N/A")
+
+        return extracted_vals
+
+def extract(source, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT, dedup=None):
+    """
+    Retrieve the values for ammonia, temperature, and pH for use from Python, with nothing written to disk.
+
+    Same values as stream_values(), as an ExtractResult with numbers, non-detect flags, & dates already parsed.
+
+    Args:
+        source - string, file object, or iterable; a report's file name (any format iter_report() reads), a CSV report already open
+            (text or binary), or its rows: dictionaries keyed by column name (e.g. from csv.DictReader) or lists with the column names first.
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        sample_point - string; see ValueStream.
+        dedup - DuplicateFilter; drop or flag repeated rows before they reach the buckets.
+
+    Returns:
+        result - ExtractResult; the values retrieved from source.
+    """
+    if is_path(source):
+        rows = _iter_clean_report(source, dedup=dedup)
+    else:
+        extra_columns, optional_columns = dedup.read_columns() if dedup is not None else ([], [])
+        rows = iter_clean(iter_report(source, compact=True, extra_columns=extra_columns, optional_columns=optional_columns), in_place=True)
+        if dedup is not None:
+            if dedup.keep == "last":
+                rows = list(rows) #* source can only be read once, so the rows are held for the second pass
+                dedup.scan(rows, extra_columns + optional_columns)
+            rows = dedup.filter(rows, extra_columns + optional_columns)
+
+    stream = ValueStream(rules, sample_point)
+    stream.feed(rows)
+    extracted_vals = stream.result() #* same checks & maxes as stream_values()
+
+    buckets = {}
+    for rule in rules:
+        for bucket in rule["buckets"]:
+            label = bucket["label"]
+            entries = stream.buckets[label].entries()
+            raw_values = [value for _, value in entries]
+            numbers, flags = NUMERIC_PARSER.parse_many(raw_values)
+            buckets[label] = BucketValues(
+                label,
+                tuple(numbers),
+                tuple(flags),
+                tuple(raw_values),
+                tuple([date.date() for date, _ in entries]),
+                extracted_vals.get(f"{label} max")
+            )
+
+    return ExtractResult(
+        source_name(source),
+        datetime.date.fromisoformat(extracted_vals["Earliest date"]),
+        datetime.date.fromisoformat(extracted_vals["Most recent date"]),
+        buckets
+    )
+
+PARALLEL_MIN_BYTES = 1 << 24 #* smallest part of a report worth its own process
+
+def _split_report(this_file, parts, min_bytes=PARALLEL_MIN_BYTES):
+    """
+    Split the rows of a .csv report into byte ranges that start & end on line boundaries, for parallel_values().
+
+    Args:
+        this_file - string; the report.
+        parts - int; number of ranges wanted; fewer are made if they would be smaller than min_bytes.
+        min_bytes - int; smallest range.
+
+    Returns:
+        ranges - list; of (start, stop) byte offsets, in file order.
+    """
+    with open(this_file, "rb") as infile:
+        infile.readline() #* header
+        start = infile.tell()
+        size = os.fstat(infile.fileno()).st_size
+        parts = max(1, min(parts, (size - start) // max(min_bytes, 1)))
+        bounds = [start]
+        for i in range(1, parts):
+            infile.seek(start + (size - start) * i // parts - 1)
+            infile.readline() #* on to the start of the next line
+            bounds.append(infile.tell())
+        bounds.append(size)
+
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+def _quoted_line_break(this_file, start, stop):
+    """
+    Check a byte range of a report for a line with an odd number of double quotes, i.e. a quoted value going on past a line break.
+    Such a value may be cut in two by _split_report(), so the range can't be read on its own.
+    """
+    with open(this_file, "rb") as infile:
+        infile.seek(start)
+        position = start
+        while position < stop:
+            block = infile.read(min(READ_BUFFER, stop - position))
+            if not block:
+                break
+            if not block.endswith(b"\n") and position + len(block) < stop:
+                block += infile.readline(stop - position - len(block)) #* finish the last line
+            position += len(block)
+            if b'"' in block and any(line.count(b'"') & 1 for line in block.split(b"\n")):
+                return True
+
+    return False
+
+def _part_values(this_file, start, stop, rules, sample_point):
+    """
+    Fill the buckets of a ValueStream from one byte range of a report, in a worker process for parallel_values().
+    Rows are numbered from 0 at start, as the number of lines before it isn't known here.
+
+    Returns:
+        part - dictionary; rows read, effluent rows, empty columns, each bucket's heap, & (local line number, message) of the error hit, if any.
+            Only {"quoted_line_break": True} if the range has a quoted value with a line break in it, see _quoted_line_break().
+    """
+    if _quoted_line_break(this_file, start, stop):
+        return {"quoted_line_break": True}
+
+    progress = ReadProgress()
+    progress.offset = start
+    progress.line_num = 0
+    stream = ValueStream(rules, sample_point)
+    error = None
+    try:
+        stream.feed(iter_clean(iter_report(this_file, compact=True, progress=progress, stop=stop), in_place=True))
+    except ValueError as e:
+        error = (progress.line_num - 1, str(e)) #* -1: before the first row, e.g. a missing column
+
+    return {
+        "rows": progress.line_num,
+        "effluent_rows": stream.effluent_rows,
+        "empty_cols": progress.empty_cols,
+        "buckets": {label: bucket.heap for label, bucket in stream.buckets.items()},
+        "error": error
+    }
+
+def parallel_values(this_file, workers=None, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT, min_bytes=PARALLEL_MIN_BYTES):
+    """
+    Retrieve the values from one large .csv report by reading parts of it in parallel, same results as stream_values().
+
+    The report is split into byte ranges on line boundaries, see _split_report(). Each worker process reads, cleans, & buckets
+    its range & only sends back the most recent values of each bucket, which are merged here; rows never leave the workers.
+    Line numbers, in buckets & in errors, are moved back to the report's own numbering once the lines in each range are known.
+    Ranges can't tell a line break inside a quoted value from the end of a row, so each worker checks its range for one first &
+    the report is read in one pass if any has. Compressed & .xlsx reports can't be split & are read in one pass too.
+
+    Args:
+        this_file - string; the file name provided by user through the command line.
+        workers - int; number of processes, defaults to the number of CPUs.
+        rules - list; what to retrieve, see EXTRACTION_RULES.
+        sample_point - string; see ValueStream.
+        min_bytes - int; smallest range given to a process, so small reports don't pay for starting processes.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved from this_file.
+    """
+    stream = ValueStream(rules, sample_point)
+    ranges = [] if is_compressed(this_file) else _split_report(this_file, workers or os.cpu_count() or 1, min_bytes)
+    parts = []
+    if len(ranges) > 1:
+        n = len(ranges)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n) as executor:
+            parts = list(executor.map(_part_values, [this_file]*n, [i[0] for i in ranges], [i[1] for i in ranges], [rules]*n, [sample_point]*n))
+    if not parts or any(part.get("quoted_line_break") for part in parts):
+        stream.feed(_iter_clean_report(this_file)) #* one pass; also lets iter_report() say what's wrong with a report without rows
+        return stream.result()
+
+    line_num = 2 #* line number of the first row of each part; same numbering as iter_report()
+    empty_cols = set(range(len(THESE_KEYS)))
+    for part in parts:
+        if part["error"] is not None:
+            local, message = part["error"]
+            raise ValueError(message if local < 0 else f"{message}Line {line_num + local} of {this_file}.\n")
+        for label, heap in part["buckets"].items():
+            bucket = stream.buckets[label]
+            for date, neg_local, value in heap:
+                bucket.add(date, line_num - neg_local, value)
+        stream.effluent_rows += part["effluent_rows"]
+        empty_cols &= part["empty_cols"]
+        line_num += part["rows"]
+    _check_empty_cols(empty_cols)
+
+    return stream.result()
+
+CACHE_VERSION = 4 #* bump when ValueStream or ReadProgress change, so old cache files are ignored
+FINGERPRINT_BYTES = 65536
+
+def _fingerprint(this_file, offset):
+    """
+    Hash the start of a report & the bytes just before offset, to tell an appended report from a rewritten one without reading all of it.
+    """
+    digest = hashlib.sha256()
+    with open(this_file, "rb") as infile:
+        digest.update(infile.read(min(offset, FINGERPRINT_BYTES)))
+        infile.seek(max(0, offset - FINGERPRINT_BYTES))
+        digest.update(infile.read(offset - infile.tell()))
+
+    return digest.hexdigest()
+
+class ReportCache:
+    """
+    Folder of cache files remembering, per report, how far it was read & the ValueStream built from it.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_file(self, this_file):
+        key = hashlib.sha1(os.path.abspath(this_file).encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    def load(self, this_file):
+        """
+        Returns:
+            entry - dictionary; saved by save() for this_file, or None if there isn't a usable one.
+        """
+        try:
+            with open(self._cache_file(this_file), "rb") as infile:
+                entry = pickle.load(infile)
+        except Exception: #* missing, unreadable, or from an older version of this script
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION:
+            return None
+
+        return entry
+
+    def save(self, this_file, entry):
+        entry = dict(entry, version=CACHE_VERSION)
+        cache_file = self._cache_file(this_file)
+        _write_atomic(cache_file, pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL), binary=True) #* never leave a half-written cache file behind
+
+def cached_values(this_file, cache_dir, metrics=None):
+    """
+    Same as stream_values(), but only reads what changed since the last run with the same cache_dir.
+
+    An unchanged report is not read at all. A report with rows appended to it only has the new rows read,
+    merged into the buckets kept from last time. Anything else, including any change to a compressed report,
+    is read again from the start.
+
+    Args:
+        this_file - string; the file name provided by user through the command line.
+        cache_dir - string; folder for the cache files, created if missing.
+        metrics - RunMetrics; record each stage in it, for the rows actually read.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved from this_file.
+    """
+    cache = ReportCache(cache_dir)
+    stat = os.stat(this_file)
+    entry = cache.load(this_file)
+
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["stream"].result()
+
+    appendable = not is_compressed(this_file) #* offsets in a compressed report don't match its bytes on disk
+    progress = entry and entry["progress"]
+    if appendable and progress and progress.complete and stat.st_size >= progress.offset and _fingerprint(this_file, progress.offset) == entry["fingerprint"]:
+        stream = entry["stream"] #* appended; carry on from the end of the last run
+    else:
+        stream, progress = ValueStream(), ReadProgress()
+
+    stream.feed(_iter_clean_report(this_file, progress=progress, metrics=metrics), metrics)
+
+    cache.save(this_file, {
+        "size": progress.offset if appendable else stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "fingerprint": _fingerprint(this_file, progress.offset) if appendable else None,
+        "progress": progress,
+        "stream": stream
+    })
+
+    return stream.result()
+
+def _timestamp():
+    """
+    Date & time to the microsecond for output file names, so runs in the same minute don't overwrite each other.
+    """
+    return datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S_%f")
+
+def _write_atomic(filename, data, binary=False):
+    """
+    Write data to filename through a temporary file in the same folder, so the file is never seen half-written.
+
+    Args:
+        filename - string; the file to create or replace.
+        data - string, or bytes when binary is set; the whole contents.
+        binary - boolean; write data as bytes.
+    """
+    temp_file = f"{filename}.{os.getpid()}.{time.time_ns()}.tmp"
+    try:
+        with open(temp_file, "xb" if binary else "x") as outfile:
+            outfile.write(data)
+        os.replace(temp_file, filename)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def _bucket_labels(found_values):
+    return [key[:-len(" values")] for key in found_values if key.endswith(" values")]
+
+def format_report(found_values, orig_fname):
+    """
+    The original export layout: a section listing each bucket's values, then one line for each bucket with a max.
+
+    Args:
+        found_values - dictionary; values found & extracted from original input file.
+        orig_fname - string; name of the original input file.
+
+    Returns:
+        text - string; the whole file.
+    """
+    parts = [
+        f"Export of values from: {orig_fname}\n",
+        f"Dates used: {found_values['Earliest date']} to {found_values['Most recent date']}",
+        "\n\n"
+    ]
+    max_lines = []
+    for label in _bucket_labels(found_values):
+        values = found_values[f"{label} values"]
+        dates = found_values[f"{label} dates"]
+        if f"{label} max" in found_values:
+            max_lines.append(f"{label} max,{found_values[f'{label} max']},,{','.join(values)},,Dates used: {dates[0]} to {dates[1]}")
+        else:
+            parts.append(f"{label} values\nDates used: {dates[0]} to {dates[1]}")
+            parts.extend(f"\n,{counter}:,{value}" for counter, value in enumerate(values, 1))
+            parts.append("\n\n")
+    parts.append("\n".join(max_lines))
+
+    return "".join(parts)
+
+def format_long(found_values, orig_fname):
+    """
+    One CSV row per value: file, label, n, value, max, first_date, last_date. A bucket with no values gets one row without n & value.
+
+    Args:
+        found_values - dictionary; values found & extracted from original input file.
+        orig_fname - string; name of the original input file.
+
+    Returns:
+        text - string; the whole file, header included.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["file", "label", "n", "value", "max", "first_date", "last_date"])
+    for label in _bucket_labels(found_values):
+        dates = found_values[f"{label} dates"]
+        bucket_max = found_values.get(f"{label} max", "")
+        values = found_values[f"{label} values"]
+        writer.writerows([orig_fname, label, counter, value, bucket_max, dates[0], dates[1]] for counter, value in enumerate(values, 1))
+        if not values:
+            writer.writerow([orig_fname, label, "", "", bucket_max, dates[0], dates[1]])
+
+    return buffer.getvalue()
+
+def format_jsonl(found_values, orig_fname):
+    """
+    One JSON object per line & bucket, with the bucket's values, max (null if not kept), & dates, plus the report's overall dates.
+
+    Args:
+        found_values - dictionary; values found & extracted from original input file.
+        orig_fname - string; name of the original input file.
+
+    Returns:
+        text - string; the whole file.
+    """
+    lines = []
+    for label in _bucket_labels(found_values):
+        dates = found_values[f"{label} dates"]
+        lines.append(json.dumps({
+            "file": orig_fname,
+            "label": label,
+            "values": found_values[f"{label} values"],
+            "max": found_values.get(f"{label} max"),
+            "first_date": str(dates[0]),
+            "last_date": str(dates[1]),
+            "earliest_date": str(found_values["Earliest date"]),
+            "most_recent_date": str(found_values["Most recent date"])
+        }) + "\n")
+
+    return "".join(lines)
+
+def format_stats(found_values, orig_fname):
+    """
+    One CSV row per bucket with value_stats() of its values: file, label, n, measured, above_limit, non_detects, max, mean, geomean, & percentiles.
+    Non-detects count at their detection limit.
+
+    Args:
+        found_values - dictionary; values found & extracted from original input file.
+        orig_fname - string; name of the original input file.
+
+    Returns:
+        text - string; the whole file, header included.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    columns = None
+    for label in _bucket_labels(found_values):
+        stats = value_stats(found_values[f"{label} values"])
+        if columns is None:
+            columns = list(stats)
+            writer.writerow(["file", "label"] + columns)
+        writer.writerow([orig_fname, label] + ["" if stats[name] is None else stats[name] for name in columns])
+
+    return buffer.getvalue()
+
+#name: (function(found_values, orig_fname) returning the file's text, ending added to the output file name), see add_export_format()
+EXPORT_FORMATS = {
+    "report": (format_report, ".csv"),
+    "long": (format_long, "_long.csv"),
+    "jsonl": (format_jsonl, ".jsonl"),
+    "stats": (format_stats, "_stats.csv"),
+}
+
+def add_export_format(name, formatter, ending):
+    """
+    Make another output format available to export_values() & --format.
+
+    Args:
+        name - string; the format's name.
+        formatter - function; called with (found_values, orig_fname), returns the file's text.
+        ending - string; added to the output file name, e.g. ".csv".
+    """
+    EXPORT_FORMATS[name] = (formatter, ending)
+
+def export_values(found_values, orig_fname, out_dir=None, fmt="report", out_path=None):
+    """
+    Format & export the results to a new file, or to stdout.
+
+    The whole file is formatted first & then written in one go through a temporary file, see _write_atomic().
+
+    Args:
+        found_values - dictionary; values found & extracted from original input file.
+        orig_fname - string; name of the original input file.
+        out_dir - string; folder for the new file, defaults to the current working directory.
+        fmt - string; one of EXPORT_FORMATS: "report" (default), "long", "jsonl", or "stats".
+        out_path - string; write to this file instead of <datetime>_VALUES_FOR-<file_name>, out_dir is then ignored. "-" writes to stdout.
+
+    Returns:
+        filename - string; name of the file created, or "-".
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"\nERROR: Unknown export format {fmt!r}, expected one of: {', '.join(EXPORT_FORMATS)}.\n")
+    formatter, ending = EXPORT_FORMATS[fmt]
+    text = formatter(found_values, orig_fname)
+
+    if out_path == "-":
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return out_path
+
+    filename = out_path
+    if filename is None:
+        filename = f"{_timestamp()}_VALUES_FOR-{report_stem(orig_fname)}{ending}"
+        if out_dir:
+            filename = os.path.join(out_dir, filename)
+    _write_atomic(filename, text)
+
+    return filename
+
+REPORT_EXTENSIONS = (".csv", ".csv.gz", ".csv.bz2", ".csv.xz", ".zip", ".xlsx") #* picked up when a folder is given to find_reports()
+
+def find_reports(sources):
+    """
+    Expand the file names, folders, & glob patterns given by the user into a list of report files.
+
+    Args:
+        sources - list; of strings, each a file name, a folder (all reports directly inside it), or a glob pattern like "reports/*.csv".
+
+    Returns:
+        reports - list; file names in the order given, without repeats.
+    """
+    reports = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = [os.path.join(source, name) for name in sorted(os.listdir(source)) if name.lower().endswith(REPORT_EXTENSIONS)]
+        elif glob.has_magic(source):
+            found = sorted(glob.glob(source))
+        else:
+            found = [source] #* missing files are reported by process_report()
+        for this_file in found:
+            if this_file not in reports:
+                reports.append(this_file)
+
+    return reports
+
+def extract_values(this_file, stream=False, cache_dir=None, metrics=None, dedup=None, parallel=0):
+    """
+    Retrieve the values from one report the way the user asked for, see process_report().
+
+    Args:
+        this_file - string; the report file to extract values from.
+        stream - boolean; use stream_values() instead of loading the whole report.
+        cache_dir - string; use cached_values() with this folder.
+        metrics - RunMetrics; record each stage in it, with the whole call as an "extract" step.
+        dedup - DuplicateFilter; drop or flag repeated rows, always streaming. Can't be used with cache_dir.
+        parallel - int; split the report across this many processes with parallel_values(). Stages aren't recorded in metrics then, only the step.
+
+    Returns:
+        extracted_vals - dictionary; the values retrieved from this_file.
+    """
+    if cache_dir and dedup is not None:
+        raise ValueError("\nERROR: Duplicate rows can't be dropped when using a cache.\n")
+    if parallel and (cache_dir or dedup is not None):
+        raise ValueError("\nERROR: A report can't be split across processes when using a cache or dropping duplicate rows.\n")
+
+    with metrics.step("extract") if metrics else contextlib.nullcontext():
+        if parallel:
+            return parallel_values(this_file, workers=parallel)
+        elif cache_dir:
+            return cached_values(this_file, cache_dir, metrics=metrics)
+        elif stream or dedup is not None:
+            return stream_values(this_file, metrics=metrics, dedup=dedup)
+        else:
+            return get_values(load_report(this_file, clean=True, metrics=metrics), metrics=metrics)
+
+def export_with_metrics(found_values, orig_fname, out_dir=None, metrics=None, fmt="report", out_path=None):
+    """
+    export_values(), recording it as the export stage & step in metrics if given.
+    """
+    if metrics is None:
+        return export_values(found_values, orig_fname=orig_fname, out_dir=out_dir, fmt=fmt, out_path=out_path)
+
+    with metrics.step("export"):
+        filename = export_values(found_values, orig_fname=orig_fname, out_dir=out_dir, fmt=fmt, out_path=out_path)
+    count = sum(len(value) for value in found_values.values() if isinstance(value, list))
+    metrics.stages["export"]["rows_in"] += count
+    metrics.stages["export"]["rows_out"] += count
+
+    return filename
+
+def process_report(this_file, out_dir=None, stream=False, cache_dir=None, profile=False, trace_memory=True, fmt="report", dedup=None, dedup_keys=DEDUP_KEYS):
+    """
+    Run load_report() -> check_clean() -> get_values() -> export_values() for one report, keeping any error with it.
+
+    Args:
+        this_file - string; the report file to extract values from.
+        out_dir - string; folder for the exported file, see export_values().
+        stream - boolean; use stream_values() instead of loading the whole report.
+        cache_dir - string; use cached_values() with this folder, only reading what changed since the last run.
+        profile - boolean; record RunMetrics for the report in summary["metrics"].
+        trace_memory - boolean; with profile, trace peak memory too, see RunMetrics.
+        fmt - string; output format, see export_values().
+        dedup - string; drop or flag repeated rows with this DuplicateFilter policy: "first", "last", or "flag".
+        dedup_keys - list; columns that make rows duplicates, see DuplicateFilter.
+
+    Returns:
+        summary - dictionary; file, status ("ok" or "failed"), output file, seconds taken, error message, & with dedup, the number of repeated rows.
+    """
+    start = time.perf_counter()
+    summary = {"file": this_file, "status": "ok", "output": "", "seconds": 0.0, "error": ""}
+    metrics = RunMetrics(this_file, trace_memory) if profile else None
+    dedup_filter = DuplicateFilter(dedup, dedup_keys) if dedup else None
+    try:
+        found_values = extract_values(this_file, stream, cache_dir, metrics, dedup_filter)
+        summary["output"] = export_with_metrics(found_values, this_file, out_dir, metrics, fmt)
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = " ".join(str(e).split()) or type(e).__name__ #* one line for the manifest
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    if dedup_filter is not None:
+        summary["duplicates"] = dedup_filter.counts["duplicates"]
+    if metrics is not None:
+        summary["metrics"] = metrics.as_dict()
+
+    return summary
+
+def run_batch(sources, workers=None, out_dir=None, stream=False, manifest=None, cache_dir=None, profile=False, trace_memory=True, fmt="report", dedup=None, dedup_keys=DEDUP_KEYS):
+    """
+    Extract values from many reports in parallel & write a manifest summarizing the run.
+
+    Args:
+        sources - list; file names, folders, or glob patterns, see find_reports().
+        workers - int; number of processes, defaults to the number of CPUs. 1 runs every report in this process.
+        out_dir - string; folder for the exported files & the manifest, defaults to the current working directory.
+        stream - boolean; use stream_values() for each report.
+        manifest - string; file name for the manifest, defaults to <datetime>_BATCH_MANIFEST.csv in out_dir.
+        cache_dir - string; folder for cached_values(), so unchanged reports are skipped.
+        profile - boolean; record RunMetrics for each report, pass them to the metrics hooks, & write them all to <manifest>.metrics.json.
+        trace_memory - boolean; with profile, trace peak memory too, see RunMetrics.
+        fmt - string; output format for each report, see export_values().
+        dedup - string; DuplicateFilter policy for each report, see process_report(). Adds a "duplicates" column to the manifest.
+        dedup_keys - list; columns that make rows duplicates, see DuplicateFilter.
+
+    Returns:
+        summaries - list; one dictionary per report from process_report(), in the order found.
+    """
+    reports = find_reports(sources)
+    if len(reports) == 0:
+        raise ValueError("\nERROR: No report files found for processing.\n")
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    if workers == 1:
+        summaries = [process_report(this_file, out_dir, stream, cache_dir, profile, trace_memory, fmt, dedup, dedup_keys) for this_file in reports]
+    else:
+        n = len(reports)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(process_report, reports, [out_dir]*n, [stream]*n, [cache_dir]*n, [profile]*n, [trace_memory]*n, [fmt]*n, [dedup]*n, [dedup_keys]*n))
+
+    if manifest is None:
+        manifest = f"{_timestamp()}_BATCH_MANIFEST.csv"
+        if out_dir:
+            manifest = os.path.join(out_dir, manifest)
+
+    with open(manifest, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=["file", "status", "output", "seconds", "error"] + (["duplicates"] if dedup else []), extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(summaries)
+
+    if profile:
+        all_metrics = [summary["metrics"] for summary in summaries]
+        for metrics_dict in all_metrics:
+            _call_metrics_hooks(metrics_dict)
+        with open(os.path.splitext(manifest)[0] + ".metrics.json", "w") as outfile:
+            json.dump(all_metrics, outfile, indent=2)
+
+    return summaries
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Extract ammonia, temperature, & pH values from a report.")
+    parser.add_argument("file_name", nargs="*", help="the report file(s) to extract values from; folders & glob patterns run in batch mode")
+    parser.add_argument("--stream", action="store_true", help="read the report in a single streaming pass; memory stays flat for very large reports")
+    parser.add_argument("--parallel", metavar="WORKERS", type=int, default=0, help="split one very large .csv report across this many processes; a report with line breaks inside quoted values is read in one pass instead")
+    parser.add_argument("--partition-by", metavar="COLUMN", action="append", help="export values separately for each value of this column, e.g. \"Permit ID\"; repeat for more columns")
+    parser.add_argument("--as-of", metavar="DATE", nargs="+", help="export the values as they were on each date (YYYY-MM-DD), in one read of the report; YYYY-MM..YYYY-MM gives every month-end")
+    parser.add_argument("--cache", metavar="CACHE_DIR", help="remember what was read in this folder; unchanged reports are skipped & appended ones only read their new rows")
+    parser.add_argument("--profile", action="store_true", help="print the time, rows, & peak memory of each stage to stderr")
+    parser.add_argument("--profile-json", action="store_true", help="same as --profile, written to <output file>.metrics.json instead; <file_name>.metrics.json with --partition-by or --as-of")
+    parser.add_argument("--dedup", choices=DEDUP_POLICIES, help="drop rows repeating an earlier (first) or later (last) row's key columns, or keep them & list them (flag)")
+    parser.add_argument("--dedup-key", metavar="COLUMN", action="append", help="with --dedup: column that makes rows duplicates (default: sample point, parameter, & start date, plus permit & outfall when the report has them); repeat for more columns")
+    parser.add_argument("--format", default="report", choices=list(EXPORT_FORMATS), help="output layout: the original report, one CSV row per value (long), JSON lines (jsonl), or statistics per bucket (stats)")
+    parser.add_argument("--output", metavar="PATH", help="single report: write to this file instead of <datetime>_VALUES_FOR-<file_name>; \"-\" writes to stdout")
+    parser.add_argument("--no-trace-memory", action="store_true", help="with --profile: skip tracing peak memory, which slows the run down")
+    parser.add_argument("--workers", type=int, help="batch mode: number of reports processed in parallel (default: number of CPUs)")
+    parser.add_argument("--out-dir", help="batch mode: folder for the exported files & the manifest (default: current folder)")
+    parser.add_argument("--manifest", help="batch mode: file name for the manifest summarizing the run")
+    args = parser.parse_args()
+    profile = args.profile or args.profile_json
+    dedup_keys = args.dedup_key or DEDUP_KEYS
+
+    batch = len(args.file_name) > 1 or any(os.path.isdir(i) or glob.has_magic(i) for i in args.file_name) or args.workers or args.out_dir or args.manifest
+
+    if args.dedup_key and not args.dedup:
+        print("\nERROR: --dedup-key only works with --dedup; add --dedup first, last, or flag.\n")
+    elif batch:
+        try:
+            if args.partition_by:
+                raise ValueError("\nERROR: --partition-by only works on a single report; run each report on its own.\n")
+            if args.parallel:
+                raise ValueError("\nERROR: --parallel only works on a single report; batch mode already runs reports in parallel, see --workers.\n")
+            if args.as_of:
+                raise ValueError("\nERROR: --as-of only works on a single report; run each report on its own.\n")
+            if args.output:
+                raise ValueError("\nERROR: --output can't be used in batch mode (several reports, a folder, a pattern, or --workers, --out-dir, or --manifest), which writes one file per report; see --out-dir.\n")
+            summaries = run_batch(args.file_name, workers=args.workers, out_dir=args.out_dir, stream=args.stream, manifest=args.manifest, cache_dir=args.cache, profile=profile, trace_memory=not args.no_trace_memory, fmt=args.format, dedup=args.dedup, dedup_keys=dedup_keys)
+            failed = [i for i in summaries if i["status"] != "ok"]
+            print(f"Processed {len(summaries)} reports: {len(summaries)-len(failed)} ok, {len(failed)} failed.")
+            for i in failed:
+                print(f"  {i['file']}: {i['error']}")
+            if args.profile:
+                for i in summaries:
+                    print(f"  {i['file']}: " + ", ".join(f"{name} {stage['seconds']} s" for name, stage in i["metrics"]["stages"].items()), file=sys.stderr)
+        except Exception as e:
+            print(e)
+    elif args.file_name:
+        try:
+            fname = args.file_name[0]
+            metrics = RunMetrics(fname, trace_memory=not args.no_trace_memory) if profile else None
+            dedup = DuplicateFilter(args.dedup, dedup_keys) if args.dedup else None
+            if args.partition_by and args.as_of:
+                raise ValueError("\nERROR: Please use either --partition-by or --as-of, not both.\n")
+            if args.partition_by and args.output:
+                raise ValueError("\nERROR: --output can't be used with --partition-by, which writes one file per partition.\n")
+            if args.as_of:
+                unused = [option for option, value in (("--output", args.output), ("--cache", args.cache), ("--stream", args.stream), ("--parallel", args.parallel)) if value]
+                if unused:
+                    raise ValueError(f"\nERROR: {', '.join(unused)} can't be used with --as-of, which reads the report once & writes one file per date.\n")
+            if args.as_of:
+                with metrics.step("extract") if metrics else contextlib.nullcontext():
+                    results, failed = as_of_values(fname, parse_cutoffs(args.as_of), metrics=metrics, dedup=dedup)
+                for cutoff, found_values in results.items():
+                    output = export_with_metrics(found_values, partition_fname(fname, (f"as-of-{cutoff}",)), metrics=metrics, fmt=args.format)
+                print(f"Exported values as of {len(results)} dates for {fname}.")
+                for cutoff, error in failed.items():
+                    print(f"  {cutoff}: {error}")
+            elif args.partition_by:
+                with metrics.step("extract") if metrics else contextlib.nullcontext():
+                    results, failed = partition_values(fname, args.partition_by, sample_point=None if "sample point description" in [i.lower() for i in args.partition_by] else SAMPLE_POINT, metrics=metrics, dedup=dedup)
+                for key, found_values in results.items():
+                    output = export_with_metrics(found_values, partition_fname(fname, key), metrics=metrics, fmt=args.format)
+                print(f"Exported {len(results)} partitions of {fname}.")
+                for key, error in failed.items():
+                    print(f"  {', '.join(key)}: {error}")
+            else:
+                output = export_with_metrics(extract_values(fname, args.stream, args.cache, metrics, dedup, args.parallel), fname, metrics=metrics, fmt=args.format, out_path=args.output)
+
+            if dedup is not None:
+                optional = [entry.lower() for entry in dedup.optional_columns]
+                key = ", ".join(name for name in dedup.key_columns if name not in optional) + (f" (& {', '.join(optional)} when the report has them)" if optional else "")
+                print(f"{dedup.counts['duplicates']} of {dedup.counts['rows']} rows repeat another row's {key}; {dedup.counts['dropped']} dropped.", file=sys.stderr)
+                for line_num, kept_line in dedup.flagged:
+                    print(f"  line {line_num} repeats line {kept_line}", file=sys.stderr)
+
+            if metrics is not None:
+                if args.profile_json and (not (args.partition_by or args.as_of) or results):
+                    metrics.write_json(f"{fname if output == '-' or args.partition_by or args.as_of else output}.metrics.json") #* one run, many exported files
+                if args.profile:
+                    metrics.report()
+                _call_metrics_hooks(metrics.as_dict())
         except Exception as e:
             print(e)
     else:
-        print("\nERROR: Please enter a file name for processing.\n")
\ No newline at end of file
+        print("\nERROR: Please enter a file name for processing.\n")
@@ -1,6 +1,100 @@
 import unittest
 import random
+import os
+import tempfile
+import bz2
+import csv as csv_module
+import datetime
+import gzip
+import importlib.util
+import io
+import json
+import lzma
+import zipfile
+import shutil
+from unittest import mock
 from extract_report_values import *
+from extract_report_values import _split_report
+
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+HEADER_ROW = [
+    "Permit ID",
+    "Sample Point Description",
+    "DMR Parameter Description Abbrv.",
+    "Concentrated Average Stat Base",
+    "Concentration Maximum Stat Base",
+    "Mon. Period Start Date",
+    "Reported Value Concentration Avg",
+    "Reported Value Concentration Max",
+    "Nodi Code"
+]
+
+def make_rows(years=4, seed=0):
+    """
+    Build rows for a small report with every parameter in every month, plus some noise.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for year in range(2016, 2016+years):
+        for month in range(1, 13):
+            date = f"{month}/1/{year}" if month % 2 else f"{month}/1/{year} 0:00"
+            for param in ["Temperature,  oC", "pH", "Nitrogen, Ammonia Total (as N)", "Flow, In Conduit or Thru Treatment Plant"]:
+                for point in ["Effluent Gross Value", "Raw Sewage Influent"]:
+                    avg = f"{rng.uniform(0, 30):.2f}"
+                    mx = rng.choice([f"{rng.uniform(0, 30):.2f}", "<0.1", ""])
+                    rows.append(["WA0000001", point, param, "MO AVG", "DAILY MX", date, avg, mx, ""])
+    rng.shuffle(rows)
+    return rows
+
+def write_csv(rows, header=HEADER_ROW, fname=None):
+    """
+    Write rows to a .csv file & return its name. Without fname, a temporary file is used & removed at exit.
+    """
+    if fname is None:
+        fd, fname = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        TEMP_FILES.append(fname)
+    with open(fname, "w", newline="") as outfile:
+        writer = csv_module.writer(outfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return fname
+
+def write_xlsx(rows, fname, header=HEADER_ROW, date_col=5):
+    """
+    Write rows to a bare-bones .xlsx file the way Excel stores them: text in shared strings, numbers & dates (as date serials) in cells, & no empty cells.
+    """
+    strings = {}
+    def cell(ref, value, col):
+        if value == "":
+            return ""
+        if col == date_col and value != header[date_col]:
+            date = StartDateParser().parse(value)
+            return f'<c r="{ref}" s="1"><v>{(date - datetime.datetime(1899, 12, 30)).days}</v></c>'
+        try:
+            float(value)
+            return f'<c r="{ref}"><v>{value}</v></c>'
+        except ValueError:
+            return f'<c r="{ref}" t="s"><v>{strings.setdefault(value, len(strings))}</v></c>'
+
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    sheet_rows = []
+    for row_num, row in enumerate([header] + rows, 1):
+        cells = "".join(cell(f"{chr(65 + col)}{row_num}", value, col) for col, value in enumerate(row))
+        sheet_rows.append(f'<row r="{row_num}">{cells}</row>')
+    shared = "".join(f"<si><t>{value.replace('&', '&amp;').replace('<', '&lt;')}</t></si>" for value in strings)
+    with zipfile.ZipFile(fname, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("xl/workbook.xml", f'<workbook {ns} xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets><sheet name="Report" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        archive.writestr("xl/_rels/workbook.xml.rels", '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+            '</Relationships>')
+        archive.writestr("xl/worksheets/sheet1.xml", f'<worksheet {ns}><sheetData>{"".join(sheet_rows)}</sheetData></worksheet>')
+        archive.writestr("xl/sharedStrings.xml", f'<sst {ns} count="{len(strings)}">{shared}</sst>')
+    return fname
+
+TEMP_FILES = []
 
 class Test_load_report(unittest.TestCase):
     """
@@ -45,6 +139,33 @@ class Test_load_report(unittest.TestCase):
         with self.assertRaises(ValueError):
             load_report(csv)
 
+class Test_load_report_compact(unittest.TestCase):
+    """
+    Test load_report() with compact=True stores the same values as ReportRow records.
+    """
+
+    def test_same_values(self):
+        fname = write_csv(make_rows(years=1))
+        x = load_report(fname)
+        y = load_report(fname, compact=True)
+
+        self.assertEqual(list(x.keys()), list(y.keys()))
+        for line_num, row in y.items():
+            self.assertIsInstance(row, ReportRow)
+            self.assertEqual(dict(row.items()), x[line_num])
+        self.assertEqual(get_values(check_clean(x)), get_values(check_clean(y)))
+
+    def test_last_col_in_header(self):
+        header = HEADER_ROW[:-1] # 'Reported Value Concentration Max' is the last col
+        rows = [row[:-1] for row in make_rows(years=1)]
+        x = load_report(write_csv(rows, header=header), compact=True)
+        self.assertGreater(len(x.keys()), 0)
+
+    def test_short_row(self):
+        rows = make_rows(years=1) + [[], ["WA0000001", "Effluent Gross Value"]]
+        x = load_report(write_csv(rows), compact=True)
+        self.assertEqual(x[len(rows)+1]["reported value concentration max"], "")
+
 class Test_check_clean(unittest.TestCase):
     """
     Test check_clean() functionality for a "good" dictionary & one with a problematic string for datetime conversion.
@@ -86,6 +207,113 @@ class Test_check_clean(unittest.TestCase):
         with self.assertRaises(ValueError):
             check_clean(this_dict)
 
+    def test_copy_or_in_place(self):
+        this_dict = {
+            1213:
+            {
+                'mon. period start date': '8/1/2016 0:00',
+                'dmr parameter description abbrv.': ' pH ',
+                'sample point description': '\t',
+                'reported value concentration avg': '',
+                'concentrated average stat base': 'MO AVG',
+                'reported value concentration max': '7.1',
+                'concentration maximum stat base': ''
+            }
+        }
+        x = check_clean(this_dict)
+        self.assertEqual(this_dict[1213]['dmr parameter description abbrv.'], ' pH ') # original left as is
+        self.assertEqual(x[1213]['dmr parameter description abbrv.'], 'ph')
+        self.assertIsNone(x[1213]['sample point description'])
+        self.assertIsNone(x[1213]['concentration maximum stat base'])
+        self.assertEqual(x[1213]['mon. period start date'], datetime.datetime(2016, 8, 1))
+
+        y = check_clean(this_dict, in_place=True)
+        self.assertIs(y, this_dict)
+        self.assertEqual(y, x)
+
+    def test_fused_load(self):
+        fname = write_csv(make_rows(years=1))
+        self.assertEqual(load_report(fname, clean=True), check_clean(load_report(fname)))
+
+class Test_StartDateParser(unittest.TestCase):
+    """
+    Test StartDateParser gives the same dates as strptime() & the same error for malformed dates.
+    """
+
+    def test_same_as_strptime(self):
+        parser = StartDateParser()
+        for value, fmt in [
+            ('8/1/2016', '%m/%d/%Y'),
+            ('08/01/2016', '%m/%d/%Y'),
+            ('12/31/2016 23:59', '%m/%d/%Y %H:%M'),
+            ('8/1/2016 0:00', '%m/%d/%Y %H:%M'),
+            ('8/1/2016 0:5', '%m/%d/%Y %H:%M'), # single digit minutes, strptime fallback
+        ]:
+            self.assertEqual(parser.parse(value), datetime.datetime.strptime(value, fmt))
+            self.assertIs(parser.parse(value), parser.parse(value)) # cached
+
+    def test_bad_dates(self):
+        parser = StartDateParser()
+        for value in ['8/1/20', '2/30/2016', '13/1/2016', '8/1/2016 24:00', ' 8/1/2016', '2016-08-01', '2016', '1', '42583']: # no Excel serials outside .xlsx reports
+            with self.assertRaises(ValueError):
+                parser.parse(value)
+
+class Test_value_stats(unittest.TestCase):
+    """
+    Test NumericParser keeps qualifier flags & value_stats() handles non-detects the way asked, with either engine.
+    """
+
+    def test_parse(self):
+        numbers, flags = NumericParser().parse_many(["1.5", " 2 ", "<0.1", "< 0.05", ">=200", "ND", "bdl", "", "E", "1e-3"])
+        self.assertEqual(numbers, [1.5, 2.0, 0.1, 0.05, 200.0, None, None, None, None, 0.001])
+        self.assertEqual(flags, ["", "", "<", "<", ">", "nd", "nd", "blank", "text", ""])
+
+    def test_non_detects(self):
+        values = ["1", "4", "<2", "ND", "", "E"]
+        stats = value_stats(values, percentiles=[50], engine="python")
+        self.assertEqual((stats["n"], stats["measured"], stats["above_limit"], stats["non_detects"]), (6, 2, 0, 2))
+        self.assertEqual((stats["max"], stats["p50"]), (4.0, 2.0))
+        self.assertAlmostEqual(stats["mean"], 7 / 3)
+        self.assertAlmostEqual(stats["geomean"], 2.0)
+        self.assertAlmostEqual(value_stats(values, non_detect="half", engine="python")["mean"], 2.0)
+        self.assertAlmostEqual(value_stats(values, non_detect="zero", engine="python")["mean"], 5 / 4)
+        self.assertAlmostEqual(value_stats(values, non_detect="exclude", engine="python")["mean"], 2.5)
+        with self.assertRaises(ValueError):
+            value_stats(values, non_detect="drop")
+
+    def test_above_limit(self):
+        stats = value_stats(["1", ">200", "<2"], engine="python")
+        self.assertEqual((stats["measured"], stats["above_limit"], stats["non_detects"], stats["max"]), (1, 1, 1, 200.0))
+
+    def test_nothing_counts(self):
+        stats = value_stats(["", "ND"])
+        self.assertEqual((stats["n"], stats["max"], stats["p95"]), (2, None, None))
+
+    def test_percentiles(self):
+        stats = value_stats([str(i) for i in range(1, 11)], percentiles=[0, 25, 95, 100], engine="python")
+        self.assertEqual([stats["p0"], stats["p25"], stats["p100"]], [1.0, 3.25, 10.0])
+        self.assertAlmostEqual(stats["p95"], 9.55)
+
+    @unittest.skipIf(not HAVE_NUMPY, "NumPy not installed")
+    def test_numpy_same(self):
+        values = [f"{random.Random(i).uniform(0, 50):.3f}" for i in range(3000)] + ["<0.1", "ND"]
+        a = value_stats(values, engine="python")
+        b = value_stats(values, engine="numpy")
+        self.assertEqual(a.keys(), b.keys())
+        for name in a:
+            self.assertAlmostEqual(a[name], b[name])
+
+    @unittest.skipIf(HAVE_NUMPY, "NumPy installed")
+    def test_no_numpy(self):
+        self.assertIsNotNone(value_stats([str(i) for i in range(NUMPY_MIN_VALUES)])["mean"]) # falls back to python
+        with self.assertRaises(ValueError):
+            value_stats(["1"], engine="numpy")
+
+    def test_max_unchanged(self):
+        x = stream_values(write_csv([row[:7] + ["<50", ""] for row in make_rows()])) # every max value a non-detect
+        self.assertEqual(x["Ammonia summer acute max"], 0.0) # non-detects still count as 0.0 in the max
+        self.assertEqual(value_stats(x["Ammonia summer acute values"])["max"], 50.0)
+
 class Test_get_values(unittest.TestCase):
     """
     Test get_values().
@@ -114,9 +342,575 @@ class Test_get_values(unittest.TestCase):
         self.assertIn('Ammonia winter acute values', x.keys())
         self.assertIn('Ammonia winter chronic max', x.keys())
         self.assertIn('Ammonia winter chronic values', x.keys())
-        
-    #TODO what about possibility of duplicate data? Multiple rows with same data?
 
-#* relying on assert in export_values() instead of creating test cases
+class Test_DuplicateFilter(unittest.TestCase):
+    """
+    Test DuplicateFilter drops or flags rows re-submitted for the same monitoring period.
+    """
+
+    def setUp(self):
+        self.rows = make_rows()
+        #* re-submit 20 periods at the end of the report, with different values & the other date format
+        self.resubmitted = [row[:5] + [row[5].split()[0] + " 0:00" if " " not in row[5] else row[5].split()[0], "999", "999", ""] for row in self.rows[:20]]
+        self.fname = write_csv(self.rows + self.resubmitted)
+
+    def test_keep_first(self):
+        dedup = DuplicateFilter("first")
+        self.assertEqual(stream_values(self.fname, dedup=dedup), stream_values(write_csv(self.rows)))
+        self.assertEqual(dedup.counts, {"rows": len(self.rows) + 20, "duplicates": 20, "dropped": 20})
+
+    def test_keep_last(self):
+        dedup = DuplicateFilter("last")
+        x = stream_values(self.fname, dedup=dedup)
+        self.assertEqual(dedup.counts["dropped"], 20)
+        expected = stream_values(write_csv(self.rows[20:] + self.resubmitted))
+        self.assertEqual(x, expected)
+
+    def test_flag(self):
+        dedup = DuplicateFilter("flag")
+        self.assertEqual(stream_values(self.fname, dedup=dedup), stream_values(self.fname))
+        self.assertEqual(dedup.counts["dropped"], 0)
+        self.assertEqual(dedup.flagged[0], (len(self.rows) + 2, 2)) # line numbers as in the file
+
+    def test_extra_key_column(self):
+        other_permit = [["WA0000002"] + row[1:] for row in self.resubmitted]
+        dedup = DuplicateFilter("first", DEDUP_KEYS + ["Permit ID"])
+        results, failed = partition_values(write_csv(self.rows + other_permit), ["Permit ID"], dedup=dedup)
+        self.assertEqual(dedup.counts["duplicates"], 0)
+        self.assertEqual(set(results), {("WA0000001",), ("WA0000002",)})
+
+    def test_permits_share_dates(self):
+        other_permit = [["WA0000002"] + row[1:] for row in self.rows]
+        fname = write_csv(self.rows + other_permit)
+        dedup = DuplicateFilter("first")
+        self.assertEqual(stream_values(fname, dedup=dedup), stream_values(fname))
+        self.assertEqual(dedup.counts["duplicates"], 0)
+
+        results, failed = partition_values(fname, ["Permit ID"])
+        dedup = DuplicateFilter("first", DEDUP_KEYS, optional_columns=[])
+        deduped, deduped_failed = partition_values(fname, ["Permit ID"], dedup=dedup)
+        self.assertEqual(deduped, results) # partition columns are added to the key
+        self.assertEqual((deduped_failed, dedup.counts["duplicates"]), (failed, 0))
+
+    def test_outfalls_share_dates(self):
+        rows = [row + [outfall] for outfall in ["001", "002"] for row in self.rows]
+        fname = write_csv(rows, header=HEADER_ROW + ["Outfall"])
+        dedup = DuplicateFilter("first")
+        self.assertEqual(stream_values(fname, dedup=dedup), stream_values(fname))
+        self.assertEqual((dedup.counts["rows"], dedup.counts["duplicates"]), (len(rows), 0))
+
+    def test_no_permit_column(self):
+        fname = write_csv([row[1:] for row in self.rows + self.resubmitted], header=HEADER_ROW[1:])
+        dedup = DuplicateFilter("first")
+        self.assertEqual(stream_values(fname, dedup=dedup), stream_values(write_csv([row[1:] for row in self.rows], header=HEADER_ROW[1:])))
+        self.assertEqual(dedup.counts["dropped"], 20)
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            DuplicateFilter("newest")
+
+class Test_extraction_rules(unittest.TestCase):
+    """
+    Test compile_rules() & extra rules given to get_values().
+    """
+
+    FLOW_RULE = {
+        "parameter": "flow, in conduit or thru treatment plant",
+        "column": "reported value concentration avg",
+        "buckets": [{"label": "Flow summer", "months": SUMMER, "size": 5}],
+    }
+
+    def test_dispatch(self):
+        dispatch, sizes = compile_rules(EXTRACTION_RULES)
+        self.assertEqual(dispatch["temperature,  oc"][5], ())
+        self.assertEqual(dispatch["temperature,  oc"][11], (("Temperature winter", "reported value concentration avg"),))
+        self.assertEqual(len(dispatch["nitrogen, ammonia total (as n)"][1]), 2) # acute & chronic
+        self.assertEqual(sizes["pH summer"], 30)
+
+    def test_extra_rule(self):
+        x = check_clean(load_report(write_csv(make_rows())))
+        y = get_values(x, rules=EXTRACTION_RULES + [self.FLOW_RULE])
+
+        self.assertEqual(len(y["Flow summer values"]), 5)
+        self.assertNotIn("Flow summer max", y)
+        self.assertEqual({k: v for k, v in y.items() if not k.startswith("Flow")}, get_values(x))
+
+    def test_repeated_label(self):
+        with self.assertRaises(ValueError):
+            compile_rules(EXTRACTION_RULES + EXTRACTION_RULES[:1])
+
+class Test_stream_values(unittest.TestCase):
+    """
+    Test stream_values() returns the same values as the full load_report() -> check_clean() -> get_values() pipeline.
+    """
+
+    def test_matches_get_values(self):
+        fname = write_csv(make_rows())
+        self.assertEqual(stream_values(fname), get_values(check_clean(load_report(fname))))
+
+    def test_ties_keep_file_order(self):
+        rows = make_rows(years=1) * 3 # every date repeated, so the windows are decided by ties
+        fname = write_csv(rows)
+        self.assertEqual(stream_values(fname), get_values(check_clean(load_report(fname))))
+
+    def test_most_recent_bucket(self):
+        bucket = MostRecent(2)
+        for line_num, day in enumerate([3, 1, 3, 2], start=2):
+            bucket.add(datetime.datetime(2020, 1, day), line_num, str(line_num))
+        self.assertEqual([value for _, value in bucket.entries()], ["2", "4"])
+
+    def test_bad_sample_pt_desc(self):
+        rows = [row for row in make_rows(years=1) if row[1] != "Effluent Gross Value"]
+        with self.assertRaises(AssertionError):
+            stream_values(write_csv(rows))
+
+class Test_partition_values(unittest.TestCase):
+    """
+    Test partition_values() gives each partition the same values as running it through stream_values() on its own.
+    """
+
+    def test_by_permit(self):
+        rows = []
+        for permit, seed in [("WA0000001", 1), ("WA0000002", 2)]:
+            rows.extend([permit] + row[1:] for row in make_rows(seed=seed))
+        rows.extend(["WA0000003", "Raw Sewage Influent"] + row[2:] for row in make_rows(years=1)) # no effluent rows
+        random.Random(0).shuffle(rows)
+
+        results, failed = partition_values(write_csv(rows), ["Permit ID"])
+        self.assertEqual(sorted(results), [("WA0000001",), ("WA0000002",)])
+        self.assertEqual(list(failed), [("WA0000003",)])
+        for (permit,), found_values in results.items():
+            this_file = write_csv([row for row in rows if row[0] == permit])
+            self.assertEqual(found_values, stream_values(this_file))
+
+    def test_by_sample_point(self):
+        results, failed = partition_values(write_csv(make_rows()), ["Sample Point Description"], sample_point=None)
+        self.assertEqual(sorted(results), [("Effluent Gross Value",), ("Raw Sewage Influent",)])
+        self.assertEqual(failed, {})
+
+    def test_missing_col(self):
+        with self.assertRaises(ValueError):
+            partition_values(write_csv(make_rows(years=1)), ["Outfall"])
+
+    def test_partition_fname(self):
+        self.assertEqual(partition_fname("in/report.csv", ("WA0000001", "Effluent Gross / Value")), "report__WA0000001_Effluent-Gross-Value.csv")
+
+class Test_compressed_reports(unittest.TestCase):
+    """
+    Test gzip, bz2, xz, & zip reports give the same values as the plain report.
+    """
+
+    def setUp(self):
+        self.report_dir = tempfile.mkdtemp()
+        self.plain = write_csv(make_rows(), fname=os.path.join(self.report_dir, "report.csv"))
+        with open(self.plain, "rb") as infile:
+            self.data = infile.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.report_dir)
+
+    def compressed(self, name):
+        fname = os.path.join(self.report_dir, name)
+        if name.endswith(".zip"):
+            with zipfile.ZipFile(fname, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("readme.txt", "not a report")
+                archive.writestr("report.csv", self.data)
+        else:
+            with {".gz": gzip, ".bz2": bz2, ".xz": lzma}[os.path.splitext(name)[1]].open(fname, "wb") as outfile:
+                outfile.write(self.data)
+        return fname
+
+    def test_same_values(self):
+        expected = stream_values(self.plain)
+        for name in ["a.csv.gz", "a.csv.bz2", "a.csv.xz", "a.zip"]:
+            fname = self.compressed(name)
+            self.assertEqual(stream_values(fname), expected)
+            self.assertEqual(load_report(fname), load_report(self.plain))
+            self.assertEqual(report_stem(fname), "a")
+
+    def test_zip_with_many_reports(self):
+        fname = os.path.join(self.report_dir, "many.zip")
+        with zipfile.ZipFile(fname, "w") as archive:
+            archive.writestr("a.csv", self.data)
+            archive.writestr("b.csv", self.data)
+        with self.assertRaises(ValueError):
+            stream_values(fname)
+
+    def test_find_reports(self):
+        for name in ["a.csv.gz", "b.zip"]:
+            self.compressed(name)
+        self.assertEqual([os.path.basename(i) for i in find_reports([self.report_dir])], ["a.csv.gz", "b.zip", "report.csv"])
+
+    def test_cached(self):
+        fname = self.compressed("a.csv.gz")
+        cache_dir = os.path.join(self.report_dir, "cache")
+        self.assertEqual(cached_values(fname, cache_dir), stream_values(self.plain))
+        with mock.patch("extract_report_values._iter_clean_report") as spy:
+            cached_values(fname, cache_dir)
+        spy.assert_not_called() # unchanged, not read again
+
+class Test_xlsx_reports(unittest.TestCase):
+    """
+    Test .xlsx reports are read straight from the sheet, with Excel date serials as start dates.
+    """
+
+    def setUp(self):
+        self.report_dir = tempfile.mkdtemp()
+        self.rows = make_rows()
+
+    def tearDown(self):
+        shutil.rmtree(self.report_dir)
+
+    def test_same_values(self):
+        fname = write_xlsx(self.rows, os.path.join(self.report_dir, "report.xlsx"))
+        self.assertEqual(stream_values(fname), stream_values(write_csv(self.rows)))
+        self.assertEqual(report_stem(fname), "report")
+
+    def test_cells(self):
+        fname = os.path.join(self.report_dir, "cells.xlsx")
+        write_xlsx([["WA0000001", "", "pH", "MO AVG", "", "5/1/2016", "7.5", "", "a & b"]], fname)
+        with zipfile.ZipFile(fname, "a") as archive: # rich text runs & an inline string, as other tools write them
+            archive.writestr("xl/worksheets/sheet1.xml", archive.read("xl/worksheets/sheet1.xml").replace(
+                b'</row></sheetData>', b'<c r="K2" t="inlineStr"><is><t>inline</t></is></c></row><row r="5"><c r="A5" t="s"><v>0</v></c></row></sheetData>'))
+        rows = list(iter_xlsx_rows(fname))
+        self.assertEqual([i[0] for i in rows], [1, 2, 5])
+        self.assertEqual(rows[1][1], ["WA0000001", "", "pH", "MO AVG", "", "05/01/2016 00:00", "7.5", "", "a & b", "", "inline"]) # only the date column's serial is a date
+        self.assertEqual(StartDateParser().parse(rows[1][1][5]), datetime.datetime(2016, 5, 1))
+
+    def test_line_numbers(self):
+        fname = write_xlsx(self.rows, os.path.join(self.report_dir, "report.xlsx"))
+        self.assertEqual([i[0] for i in iter_report(fname)][:3], [2, 3, 4])
+
+    def test_missing_col(self):
+        fname = write_xlsx([i[1:] for i in self.rows], os.path.join(self.report_dir, "report.xlsx"), header=HEADER_ROW[1:], date_col=4)
+        self.assertEqual(len(list(iter_report(fname))), len(self.rows))
+        fname = write_xlsx([i[:5] for i in self.rows], os.path.join(self.report_dir, "short.xlsx"), header=HEADER_ROW[:5])
+        with self.assertRaises(ValueError):
+            stream_values(fname)
+
+class Test_parallel_values(unittest.TestCase):
+    """
+    Test parallel_values() gives the same results & line numbers as reading the report in one pass.
+    """
+
+    def setUp(self):
+        self.rows = make_rows(seed=1) + make_rows(seed=2) # same dates twice, so ties across parts are broken by line number
+
+    def test_split_on_lines(self):
+        fname = write_csv(self.rows)
+        ranges = _split_report(fname, 4, min_bytes=1000)
+        self.assertEqual(len(ranges), 4)
+        with open(fname, "rb") as infile:
+            data = infile.read()
+        self.assertEqual(ranges[0][0], data.index(b"\n") + 1)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, stop), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop, next_start)
+            self.assertEqual(data[start-1:start], b"\n")
+
+    def test_same_values(self):
+        fname = write_csv(self.rows)
+        self.assertEqual(parallel_values(fname, workers=3, min_bytes=1000), stream_values(fname))
+        self.assertEqual(parallel_values(fname, workers=3), stream_values(fname)) # too small to split
+
+    def test_error_line_number(self):
+        rows = [list(row) for row in self.rows]
+        rows[700][5] = "13/45/2019"
+        with self.assertRaises(ValueError) as e:
+            parallel_values(write_csv(rows), workers=3, min_bytes=1000)
+        self.assertIn("Line 702 of", str(e.exception)) # 700th row after the header
+
+    def test_missing_col(self):
+        fname = write_csv([row[1:] for row in self.rows], header=HEADER_ROW[1:])
+        self.assertEqual(parallel_values(fname, workers=2, min_bytes=1000), stream_values(fname))
+        fname = write_csv([row[:-4] for row in self.rows], header=HEADER_ROW[:-4])
+        with self.assertRaises(ValueError) as e:
+            parallel_values(fname, workers=2, min_bytes=1000)
+        self.assertNotIn("Line", str(e.exception))
+
+    def test_quoted_line_break(self):
+        rows = [list(row) for row in self.rows]
+        rows[699][HEADER_ROW.index("Nodi Code")] = "see\nnote" # csv splits this row over 2 lines
+        rows[700][5] = "13/45/2019"
+        fname = write_csv(rows)
+        with self.assertRaises(ValueError) as e:
+            parallel_values(fname, workers=3, min_bytes=1000)
+        self.assertNotIn("Line", str(e.exception)) # read in one pass, so no part's line numbers
+        rows[700][5] = self.rows[700][5]
+        fname = write_csv(rows)
+        self.assertEqual(parallel_values(fname, workers=3, min_bytes=1000), stream_values(fname))
+
+class Test_as_of_values(unittest.TestCase):
+    """
+    Test as_of_values() gives the same results as running stream_values() on the report cut down to each cutoff date.
+    """
+
+    def setUp(self):
+        self.rows = make_rows(seed=1) + make_rows(seed=2) # same dates twice, so windows end in ties
+
+    def cut_down(self, cutoff):
+        return [row for row in self.rows if datetime.datetime.strptime(row[5].split()[0], "%m/%d/%Y").date() <= cutoff]
+
+    def test_month_ends(self):
+        self.assertEqual(month_ends("2016-11", "2017-02"), [datetime.date(2016, 11, 30), datetime.date(2016, 12, 31), datetime.date(2017, 1, 31), datetime.date(2017, 2, 28)])
+        self.assertEqual(parse_cutoffs(["2017-01..2017-02", "2017-01-31", "2016-06-15"]), [datetime.date(2016, 6, 15), datetime.date(2017, 1, 31), datetime.date(2017, 2, 28)])
+        with self.assertRaises(ValueError):
+            parse_cutoffs(["2017-13-01"])
+
+    def test_same_as_cut_down(self):
+        cutoffs = month_ends("2016-01", "2020-02")
+        results, failed = as_of_values(write_csv(self.rows), cutoffs)
+        self.assertEqual(set(results) | set(failed), set(cutoffs))
+        self.assertIn(datetime.date(2016, 1, 31), failed) # no summer values yet
+        for cutoff in cutoffs[::5] + cutoffs[-3:]:
+            if cutoff in results:
+                self.assertEqual(results[cutoff], stream_values(write_csv(self.cut_down(cutoff))), cutoff)
+
+    def test_cutoff_before_report(self):
+        results, failed = as_of_values(write_csv(self.rows), [datetime.date(2000, 1, 1)])
+        self.assertEqual(results, {})
+        self.assertIn("No \"Effluent Gross Value\" entries found", failed[datetime.date(2000, 1, 1)])
+
+    def test_no_cutoffs(self):
+        with self.assertRaises(ValueError):
+            as_of_values(write_csv(self.rows), [])
+
+class Test_extract(unittest.TestCase):
+    """
+    Test extract() gives the same values as stream_values() for a file name, an open file, or rows in memory, parsed into typed records.
+    """
+
+    def setUp(self):
+        self.rows = make_rows()
+        self.fname = write_csv(self.rows)
+        self.expected = stream_values(self.fname)
+
+    def test_file_name(self):
+        x = extract(self.fname)
+        self.assertEqual(x.as_dict(), self.expected)
+        self.assertEqual(x.source, self.fname)
+        self.assertEqual(str(x.most_recent_date), self.expected["Most recent date"])
+
+    def test_typed_values(self):
+        x = extract(self.fname)
+        bucket = x["Ammonia summer acute"]
+        self.assertEqual(bucket.raw_values, tuple(self.expected["Ammonia summer acute values"]))
+        for value, flag, raw in zip(bucket.values, bucket.flags, bucket.raw_values):
+            if raw == "":
+                self.assertEqual((value, flag), (None, "blank"))
+            elif raw == "<0.1":
+                self.assertEqual((value, flag), (0.1, "<"))
+            else:
+                self.assertEqual((value, flag), (float(raw), ""))
+        self.assertEqual(bucket.max, self.expected["Ammonia summer acute max"])
+        self.assertIsNone(x["pH summer"].max)
+        self.assertEqual(list(bucket.dates), sorted(bucket.dates, reverse=True))
+        self.assertEqual((bucket.first_date, bucket.last_date), self.expected["Ammonia summer acute dates"])
+        with self.assertRaises(AttributeError):
+            bucket.note = "no room" # slots only
+
+    def test_open_file(self):
+        with open(self.fname, "rb") as infile:
+            self.assertEqual(extract(infile).as_dict(), self.expected)
+            self.assertFalse(infile.closed)
+        with open(self.fname, newline="") as infile:
+            self.assertEqual(extract(io.StringIO(infile.read())).as_dict(), self.expected)
+
+    def test_rows_in_memory(self):
+        self.assertEqual(extract([HEADER_ROW] + self.rows).as_dict(), self.expected)
+        with open(self.fname, newline="") as infile:
+            self.assertEqual(extract(csv_module.DictReader(infile)).as_dict(), self.expected)
+
+        #* values as a database would return them
+        rows = []
+        for row in self.rows:
+            values = dict(zip(HEADER_ROW, row))
+            values["Mon. Period Start Date"] = datetime.datetime.strptime(row[5].split()[0], "%m/%d/%Y")
+            rows.append(values)
+        self.assertEqual(extract(rows).as_dict(), self.expected)
+
+    def test_dedup_last(self):
+        resubmitted = [row[:6] + ["999", "999", ""] for row in self.rows[:20]]
+        dedup = DuplicateFilter("last")
+        x = extract(iter([HEADER_ROW] + self.rows + resubmitted), dedup=dedup)
+        self.assertEqual(dedup.counts["dropped"], 20)
+        self.assertEqual(x.as_dict(), stream_values(write_csv(self.rows[20:] + resubmitted)))
+
+    def test_missing_col(self):
+        with self.assertRaises(ValueError) as e:
+            extract([HEADER_ROW[:-3]] + [row[:-3] for row in self.rows])
+        self.assertIn("<rows>", str(e.exception))
+        with self.assertRaises(ValueError):
+            extract([])
+
+class Test_cached_values(unittest.TestCase):
+    """
+    Test cached_values() skips unchanged reports & only reads the rows appended to a report since the last run.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_unchanged(self):
+        fname = write_csv(make_rows())
+        x = cached_values(fname, self.cache_dir)
+        self.assertEqual(x, stream_values(fname))
+        with mock.patch("extract_report_values.iter_report", side_effect=AssertionError("report was read again")):
+            self.assertEqual(cached_values(fname, self.cache_dir), x)
+
+    def test_appended(self):
+        rows = make_rows(years=6)
+        fname = write_csv(rows[:len(rows)//2])
+        cached_values(fname, self.cache_dir)
+        with open(fname, "a", newline="") as outfile:
+            csv_module.writer(outfile).writerows(rows[len(rows)//2:])
+
+        read = []
+        def spy(this_file, **kwargs):
+            for line_num, row in iter_report(this_file, **kwargs):
+                read.append(line_num)
+                yield line_num, row
+        with mock.patch("extract_report_values.iter_report", spy):
+            x = cached_values(fname, self.cache_dir)
+        self.assertEqual(x, stream_values(fname))
+        self.assertEqual(read[0], len(rows)//2 + 2) # picked up after the last row read before
+
+    def test_rewritten(self):
+        fname = write_csv(make_rows(seed=1))
+        cached_values(fname, self.cache_dir)
+        write_csv(make_rows(seed=2), fname=fname)
+        self.assertEqual(cached_values(fname, self.cache_dir), stream_values(fname))
+
+class Test_RunMetrics(unittest.TestCase):
+    """
+    Test RunMetrics records the rows through each stage & the hooks see batch metrics.
+    """
+
+    def test_stages(self):
+        rows = make_rows(years=2)
+        metrics = RunMetrics(trace_memory=False)
+        with metrics.step("extract"):
+            x = stream_values(write_csv(rows), metrics=metrics)
+        self.assertEqual(x, stream_values(write_csv(rows)))
+
+        y = metrics.as_dict()
+        effluent = sum(1 for row in rows if row[1] == "Effluent Gross Value")
+        self.assertEqual(y["stages"]["read"]["rows_out"], len(rows))
+        self.assertEqual(y["stages"]["normalize"]["rows_in"], len(rows))
+        self.assertEqual(y["stages"]["filter"]["rows_out"], effluent)
+        self.assertLess(y["stages"]["bucket"]["rows_out"], effluent) # flow isn't bucketed
+        self.assertEqual(sum(y["date_formats"].values()), len(rows))
+        self.assertEqual(y["non_numeric"]["<0.1"], sum(1 for row in rows if row[7] == "<0.1"))
+        self.assertIsNone(y["steps"]["extract"]["peak_mb"])
+
+    def test_same_for_load_report(self):
+        fname = write_csv(make_rows(years=2))
+        a, b = RunMetrics(trace_memory=False), RunMetrics(trace_memory=False)
+        stream_values(fname, metrics=a)
+        get_values(load_report(fname, clean=True, metrics=b), metrics=b)
+        for name in ["read", "normalize", "filter", "bucket"]:
+            self.assertEqual(a.as_dict()["stages"][name]["rows_out"], b.as_dict()["stages"][name]["rows_out"])
+
+    def test_batch_hook(self):
+        seen = []
+        add_metrics_hook(seen.append)
+        try:
+            with tempfile.TemporaryDirectory() as out_dir:
+                summaries = run_batch([write_csv(make_rows())], workers=1, out_dir=out_dir, profile=True)
+                self.assertTrue(any(name.endswith(".metrics.json") for name in os.listdir(out_dir)))
+        finally:
+            METRICS_HOOKS.remove(seen.append)
+        self.assertEqual(seen, [summaries[0]["metrics"]])
+        self.assertIsNotNone(seen[0]["steps"]["extract"]["peak_mb"])
+
+class Test_run_batch(unittest.TestCase):
+    """
+    Test run_batch() processes a folder of reports, keeping each report's errors with it.
+    """
+
+    def test_folder(self):
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            for name, rows in [("a.csv", make_rows(seed=1)), ("b.csv", make_rows(seed=2)), ("c.csv", [])]:
+                write_csv(rows, fname=os.path.join(in_dir, name)) # c.csv has no values
+            manifest = os.path.join(out_dir, "manifest.csv")
+            summaries = run_batch([in_dir], workers=2, out_dir=out_dir, manifest=manifest)
+
+            self.assertEqual([os.path.basename(i["file"]) for i in summaries], ["a.csv", "b.csv", "c.csv"])
+            self.assertEqual([i["status"] for i in summaries], ["ok", "ok", "failed"])
+            self.assertIn("No values found", summaries[2]["error"])
+            self.assertTrue(os.path.exists(summaries[0]["output"]))
+            with open(manifest) as infile:
+                self.assertEqual(len(list(csv_module.DictReader(infile))), 3)
+
+    def test_nothing_found(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            with self.assertRaises(ValueError):
+                run_batch([os.path.join(in_dir, "*.csv")])
+
+class Test_export_values(unittest.TestCase):
+    """
+    Test export_values() writes each format in one go, to a new file, a chosen path, or stdout.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.found = stream_values(write_csv(make_rows()))
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = export_values(self.found, "in/report.csv", out_dir)
+            self.assertTrue(os.path.basename(filename).endswith("_VALUES_FOR-report.csv"))
+            with open(filename) as infile:
+                lines = infile.read().split("\n")
+            self.assertEqual(lines[0], "Export of values from: in/report.csv")
+            self.assertEqual(lines[3], "pH summer values")
+            self.assertEqual(lines[5], f",1:,{self.found['pH summer values'][0]}")
+            self.assertEqual([i.split(",")[0] for i in lines[-4:]], [
+                "Ammonia summer acute max", "Ammonia summer chronic max", "Ammonia winter acute max", "Ammonia winter chronic max"
+            ])
+            self.assertEqual(os.listdir(out_dir), [os.path.basename(filename)]) # no temporary file left behind
+
+    def test_no_overwrite(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            names = {export_values(self.found, "report.csv", out_dir) for i in range(3)}
+            self.assertEqual(len(names), 3)
+
+    def test_long(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            filename = export_values(self.found, "report.csv", fmt="long", out_path=os.path.join(out_dir, "out.csv"))
+            with open(filename, newline="") as infile:
+                rows = list(csv_module.DictReader(infile))
+            ph = [i["value"] for i in rows if i["label"] == "pH summer"]
+            self.assertEqual(ph, self.found["pH summer values"])
+            self.assertEqual({i["max"] for i in rows if i["label"] == "Ammonia winter acute"}, {str(self.found["Ammonia winter acute max"])})
+
+    def test_jsonl_stdout(self):
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            self.assertEqual(export_values(self.found, "report.csv", fmt="jsonl", out_path="-"), "-")
+        lines = [json.loads(i) for i in stdout.getvalue().splitlines()]
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(lines[0]["values"], self.found["pH summer values"])
+        self.assertEqual(lines[-1]["max"], self.found["Ammonia winter chronic max"])
+
+    def test_stats(self):
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            export_values(self.found, "report.csv", fmt="stats", out_path="-")
+        rows = list(csv_module.DictReader(io.StringIO(stdout.getvalue())))
+        self.assertEqual(len(rows), 8)
+        ph = rows[0]
+        self.assertEqual((ph["label"], int(ph["n"])), ("pH summer", len(self.found["pH summer values"])))
+        self.assertEqual(float(rows[4]["max"]), self.found["Ammonia summer acute max"])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            export_values(self.found, "report.csv", fmt="xml", out_path="-")
+
 
-unittest.main(verbosity=2)
+try:
+    unittest.main(verbosity=2)
+finally:
+    for fname in TEMP_FILES:
+        os.remove(fname)
@@ -0,0 +1,336 @@
+######################################################################################
+# This file keeps extract_report_values.py running as a local web service, so        #
+# other programs can send it reports without starting Python for each one.           #
+#                                                                                    #
+# It can be run by opening a Python terminal & entering:                             #
+# "report_server.py --port 8765"                                                     #
+#                                                                                    #
+# without the double quotes. It only listens on this computer (127.0.0.1). POST a    #
+# report's contents to http://127.0.0.1:8765/extract?name=<file_name.csv>, or JSON   #
+# like {"path": "<file_name.csv>"} to read a file, & the values come back as JSON.   #
+# Reports with the same contents are only extracted once (see --cache-size).         #
+# GET /health returns counts of requests, cache hits, errors, & reports per second.  #
+#                                                                                    #
+######################################################################################
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from extract_report_values import DEDUP_POLICIES, READ_BUFFER, DuplicateFilter, extract, is_compressed, stream_values
+
+HOST = "127.0.0.1" #* local requests only; the service has no authentication
+MAX_UPLOAD_BYTES = 1 << 30
+
+def _file_stamp(this_file):
+    """
+    Size & modification time of a file, to tell whether it changed since it was hashed.
+    """
+    stat = os.stat(this_file)
+
+    return stat.st_size, stat.st_mtime_ns
+
+def _file_digest(this_file):
+    """
+    Hash a file in blocks of READ_BUFFER bytes, so large reports aren't held in memory.
+
+    Args:
+        this_file - string; name of the file.
+
+    Returns:
+        (digest, stamp) - tuple; SHA-256 of the file's contents & its _file_stamp().
+    """
+    stamp = _file_stamp(this_file)
+    digest = hashlib.sha256()
+    with open(this_file, "rb") as infile:
+        while block := infile.read(READ_BUFFER):
+            digest.update(block)
+    if _file_stamp(this_file) != stamp:
+        raise ValueError(f"\nERROR: {this_file} changed while it was being hashed; send the request again.\n")
+
+    return digest.hexdigest(), stamp
+
+def _extract_report(source, name, dedup, stamp=None):
+    """
+    Extract the values from one report, in a worker process.
+
+    Args:
+        source - bytes or string; the report's contents, or its file name.
+        name - string; the report's file name, used to tell compressed reports & .xlsx workbooks from CSV.
+        dedup - string; DuplicateFilter policy, or None.
+        stamp - tuple; with a file name, the _file_stamp() it had when it was hashed. The values are only returned if the file
+            still has it after they are read, so they always belong to the hash they are cached under.
+
+    Returns:
+        (found_values, seconds) - tuple; same as stream_values() & the time it took.
+    """
+    start = time.perf_counter()
+    dedup = DuplicateFilter(dedup) if dedup else None
+    if isinstance(source, str):
+        if _file_stamp(source) != stamp:
+            raise ValueError(f"\nERROR: {source} changed after it was hashed; send the request again.\n")
+        found_values = stream_values(source, dedup=dedup)
+        if _file_stamp(source) != stamp:
+            raise ValueError(f"\nERROR: {source} changed while it was being read; send the request again.\n")
+    elif is_compressed(name):
+        tmp_dir = tempfile.mkdtemp() #* compressed reports & workbooks are read from a file
+        try:
+            this_file = os.path.join(tmp_dir, os.path.basename(name))
+            with open(this_file, "wb") as outfile:
+                outfile.write(source)
+            found_values = stream_values(this_file, dedup=dedup)
+        finally:
+            shutil.rmtree(tmp_dir)
+    else:
+        found_values = extract(io.BytesIO(source), dedup=dedup).as_dict()
+
+    return found_values, time.perf_counter() - start
+
+class ResultCache:
+    """
+    Least recently used results, keyed by the report's content hash & options. Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+class ServerStats:
+    """
+    Counters for GET /health. Safe to share between threads.
+    """
+
+    COUNTERS = ("requests", "extractions", "cache_hits", "joined", "errors")
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.in_flight = 0
+        self.seconds = 0.0 #* total time spent extracting, in the workers
+
+    def add(self, name, seconds=0.0):
+        with self.lock:
+            self.counts[name] += 1
+            self.seconds += seconds
+
+    def running(self, change):
+        with self.lock:
+            self.in_flight += change
+
+    def as_dict(self):
+        with self.lock:
+            uptime = time.time() - self.started
+            return {
+                "uptime_seconds": round(uptime, 3),
+                **self.counts,
+                "in_flight": self.in_flight,
+                "reports_per_second": round((self.counts["extractions"] + self.counts["cache_hits"]) / uptime, 3) if uptime else 0.0,
+                "mean_extraction_seconds": round(self.seconds / self.counts["extractions"], 4) if self.counts["extractions"] else None,
+            }
+
+class ReportServer(ThreadingHTTPServer):
+    """
+    HTTP server that extracts values from reports on a pool of worker processes & caches the results.
+
+    Each request is handled on its own thread, which waits for a worker. Requests for a report already being extracted
+    wait for that extraction instead of starting another.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=8765, workers=None, cache_size=256, quiet=False):
+        """
+        Args:
+            port - int; port to listen on; 0 picks a free one (see server_address).
+            workers - int; number of processes, defaults to the number of CPUs. 1 extracts in this process.
+            cache_size - int; number of results kept, 0 turns the cache off.
+            quiet - boolean; don't log each request to stderr.
+        """
+        super().__init__((HOST, port), ExtractHandler)
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers == 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        self.cache = ResultCache(cache_size)
+        self.stats = ServerStats()
+        self.quiet = quiet
+        self.pending = {} #* key: future of an extraction still running
+        self.pending_lock = threading.Lock()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+    def get_values(self, source, name, digest, dedup=None, stamp=None):
+        """
+        Extract the values from a report, or take them from the cache.
+
+        Args:
+            source - bytes or string; the report's contents, or its file name.
+            name - string; the report's file name.
+            digest - string; SHA-256 of the report's contents.
+            dedup - string; DuplicateFilter policy, or None.
+            stamp - tuple; with a file name, its _file_stamp() when digest was worked out, see _extract_report().
+
+        Returns:
+            (found_values, cached) - tuple; same as stream_values() & whether it came from the cache (or another request's extraction).
+        """
+        key = (digest, os.path.splitext(name.lower())[1], dedup) #* same contents read as a different format may give different values
+        found_values = self.cache.get(key)
+        if found_values is not None:
+            self.stats.add("cache_hits")
+            return found_values, True
+
+        with self.pending_lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = self.executor.submit(_extract_report, source, name, dedup, stamp)
+        if not owner:
+            self.stats.add("joined")
+            return future.result()[0], True
+
+        self.stats.running(1)
+        try:
+            found_values, seconds = future.result()
+            self.cache.put(key, found_values)
+            self.stats.add("extractions", seconds)
+        finally:
+            self.stats.running(-1)
+            with self.pending_lock:
+                del self.pending[key]
+
+        return found_values, False
+
+class ExtractHandler(BaseHTTPRequestHandler):
+    """
+    GET /health & POST /extract, see the top of this file.
+    """
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=str).encode() #* dates as "2016-08-01"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, message):
+        self.server.stats.add("errors")
+        self._send_json(status, {"error": " ".join(str(message).split())})
+
+    def do_GET(self):
+        self.server.stats.add("requests")
+        if urllib.parse.urlsplit(self.path).path != "/health":
+            return self._send_error(404, f"Unknown path {self.path}; use GET /health or POST /extract.")
+
+        self._send_json(200, {"status": "ok", "workers": self.server.workers, "cache_entries": len(self.server.cache), **self.server.stats.as_dict()})
+
+    def do_POST(self):
+        self.server.stats.add("requests")
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/extract":
+            return self._send_error(404, f"Unknown path {self.path}; use GET /health or POST /extract.")
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            return self._send_error(411, "Content-Length is required.")
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send_error(400, "Content-Length must be a number of bytes.")
+        if length > MAX_UPLOAD_BYTES:
+            return self._send_error(413, f"Reports over {MAX_UPLOAD_BYTES} bytes can't be uploaded; send their path instead.")
+        body = self.rfile.read(length)
+
+        if self.headers.get_content_type() == "application/json":
+            try:
+                request = json.loads(body)
+                name = request["path"]
+            except (ValueError, TypeError, KeyError):
+                return self._send_error(400, 'Expected JSON like {"path": "<file_name.csv>"}.')
+            if not isinstance(name, str) or not name or "\0" in name: #* an int would open() a file descriptor of the server's own
+                return self._send_error(400, "path must be a file name.")
+            dedup = request.get("dedup")
+            try:
+                digest, stamp = _file_digest(name) #* the worker reads the file itself & checks it's still what was hashed
+            except OSError as e:
+                return self._send_error(404, e)
+            except ValueError as e:
+                return self._send_error(409, e)
+            source = name
+        else:
+            name = query.get("name", "upload.csv")
+            dedup = query.get("dedup")
+            digest = hashlib.sha256(body).hexdigest()
+            source = body
+            stamp = None
+
+        if dedup is not None and dedup not in DEDUP_POLICIES:
+            return self._send_error(400, f"dedup must be one of: {', '.join(DEDUP_POLICIES)}.")
+
+        try:
+            found_values, cached = self.server.get_values(source, name, digest, dedup, stamp)
+        except (AssertionError, ValueError) as e:
+            return self._send_error(422, e)
+        except Exception as e:
+            return self._send_error(500, e)
+
+        self._send_json(200, {"file": name, "sha256": digest, "cached": cached, "values": found_values})
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve extract_report_values.py on this computer.")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("--workers", type=int, help="number of reports extracted at once (default: number of CPUs)")
+    parser.add_argument("--cache-size", type=int, default=256, help="number of results kept for reports sent again (default: 256); 0 turns the cache off")
+    parser.add_argument("--quiet", action="store_true", help="don't log each request")
+    args = parser.parse_args()
+
+    server = ReportServer(args.port, args.workers, args.cache_size, args.quiet)
+    print(f"Serving on http://{HOST}:{server.server_address[1]} with {server.workers} workers; press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,176 @@
+import unittest
+import csv
+import gzip
+import hashlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import shutil
+import threading
+import urllib.error
+import urllib.request
+from report_server import *
+from report_server import _extract_report, _file_digest
+from bench_report_values import HEADER_ROW, iter_generated_rows
+from extract_report_values import stream_values
+
+def report_bytes(rows, seed=0):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER_ROW)
+    writer.writerows(iter_generated_rows(rows, seed))
+    return buffer.getvalue().encode()
+
+def as_json(found_values):
+    return json.loads(json.dumps(found_values, default=str))
+
+class Test_ResultCache(unittest.TestCase):
+    """
+    Test ResultCache drops the least recently used result first.
+    """
+
+    def test_lru(self):
+        cache = ResultCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1) # b is now the oldest
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c"), len(cache)), (1, 3, 2))
+
+    def test_off(self):
+        cache = ResultCache(0)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+class Test_ReportServer(unittest.TestCase):
+    """
+    Test ReportServer gives the same values as stream_values() for uploads & paths, caches them, & counts requests.
+    """
+
+    workers = 1
+
+    def setUp(self):
+        self.server = ReportServer(port=0, workers=self.workers, cache_size=8, quiet=True)
+        self.url = f"http://{HOST}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.report_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.report_dir)
+
+    def post(self, path, data, content_type="text/csv"):
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    def health(self):
+        with urllib.request.urlopen(self.url + "/health") as response:
+            return json.load(response)
+
+    def test_upload(self):
+        data = report_bytes(3000)
+        fname = os.path.join(self.report_dir, "a.csv")
+        with open(fname, "wb") as outfile:
+            outfile.write(data)
+
+        status, body = self.post("/extract?name=a.csv", data)
+        self.assertEqual(status, 200)
+        self.assertEqual(body["values"], as_json(stream_values(fname)))
+        self.assertFalse(body["cached"])
+
+        status, body = self.post("/extract?name=b.csv", data) # same contents, other name
+        self.assertTrue(body["cached"])
+        health = self.health()
+        self.assertEqual((health["extractions"], health["cache_hits"], health["errors"]), (1, 1, 0))
+
+    def test_compressed_upload(self):
+        data = report_bytes(3000)
+        status, body = self.post("/extract?name=a.csv.gz", gzip.compress(data))
+        self.assertEqual(status, 200)
+        self.assertEqual(body["values"], self.post("/extract", data)[1]["values"])
+
+    def test_path(self):
+        fname = os.path.join(self.report_dir, "a.csv")
+        with open(fname, "wb") as outfile:
+            outfile.write(report_bytes(3000, seed=1))
+        status, body = self.post("/extract", json.dumps({"path": fname, "dedup": "first"}).encode(), "application/json")
+        self.assertEqual(status, 200)
+        self.assertEqual(body["values"], as_json(stream_values(fname)))
+
+        with open(fname, "wb") as outfile:
+            outfile.write(report_bytes(3000, seed=2)) # new contents, same name
+        self.assertFalse(self.post("/extract", json.dumps({"path": fname}).encode(), "application/json")[1]["cached"])
+
+    def test_path_error_names_file(self):
+        fname = os.path.join(self.report_dir, "a.csv")
+        with open(fname, "wb") as outfile:
+            outfile.write(report_bytes(100).replace(b"Sample Point Description", b"Point"))
+        status, body = self.post("/extract", json.dumps({"path": fname}).encode(), "application/json")
+        self.assertEqual(status, 422)
+        self.assertIn(fname, body["error"])
+
+    def test_path_changed(self):
+        fname = os.path.join(self.report_dir, "a.csv")
+        data = report_bytes(3000)
+        with open(fname, "wb") as outfile:
+            outfile.write(data)
+        digest, stamp = _file_digest(fname)
+        self.assertEqual(digest, hashlib.sha256(data).hexdigest())
+        self.assertEqual(_extract_report(fname, fname, None, stamp)[0], stream_values(fname))
+        with open(fname, "ab") as outfile:
+            outfile.write(data[-200:]) # appended after it was hashed
+        with self.assertRaises(ValueError):
+            _extract_report(fname, fname, None, stamp)
+
+    def test_errors(self):
+        status, body = self.post("/extract", report_bytes(3000).replace(b"Effluent Gross Value", b"Influent"))
+        self.assertEqual(status, 422)
+        self.assertIn("No \"Effluent Gross Value\" entries found", body["error"])
+        self.assertEqual(self.post("/extract", b"{}", "application/json")[0], 400)
+        self.assertEqual(self.post("/extract", json.dumps({"path": os.path.join(self.report_dir, "missing.csv")}).encode(), "application/json")[0], 404)
+        self.assertEqual(self.post("/extract?dedup=newest", report_bytes(100))[0], 400)
+        self.assertEqual(self.post("/other", b"")[0], 404)
+        for path in [0, 3, None, ["a"], "", "a\0b"]:
+            self.assertEqual(self.post("/extract", json.dumps({"path": path}).encode(), "application/json")[0], 400, path)
+        self.assertEqual(self.health()["status"], "ok") # still listening
+        for length in ["abc", "-1"]:
+            connection = http.client.HTTPConnection(HOST, self.server.server_address[1])
+            connection.request("POST", "/extract", headers={"Content-Length": length})
+            self.assertEqual(connection.getresponse().status, 400)
+            connection.close()
+        self.assertEqual(self.health()["errors"], 13)
+
+class Test_ReportServer_workers(Test_ReportServer):
+    """
+    Same tests on a pool of worker processes, plus requests for one report at the same time.
+    """
+
+    workers = 2
+
+    def test_concurrent(self):
+        data = report_bytes(20000)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.post("/extract", data))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([status for status, _ in results], [200] * 4)
+        self.assertEqual(len({json.dumps(body["values"]) for _, body in results}), 1)
+        health = self.health()
+        self.assertEqual(health["extractions"], 1) # the others joined it or found it cached
+        self.assertEqual(health["joined"] + health["cache_hits"], 3)
+        self.assertEqual(health["in_flight"], 0)
+
+unittest.main(verbosity=2)
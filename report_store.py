@@ -0,0 +1,195 @@
+######################################################################################
+# This file keeps the rows of many reports in a local SQLite database, so values for #
+# one facility can be pulled from years of history without reading the reports again.#
+#                                                                                    #
+# It can be run by opening a Python terminal & entering:                             #
+# "report_store.py history.db --ingest <file_name.csv> --facility WA0000001"         #
+#                                                                                    #
+# without the double quotes. --ingest adds the rows of each report given (files,     #
+# folders, or glob patterns, as for extract_report_values.py) to the database; a row #
+# for a permit, outfall, sample point, parameter, & month already stored is replaced #
+# by the newer one. --facility exports the values for one permit the same way        #
+# extract_report_values.py does; leave it out to use every permit in the database.   #
+#                                                                                    #
+######################################################################################
+
+import argparse
+import datetime
+import sqlite3
+
+from extract_report_values import (
+    EXPORT_FORMATS, EXTRACTION_RULES, OUTFALL_COLUMNS, SAMPLE_POINT, ReportRow, ValueStream,
+    export_values, find_reports, iter_clean, iter_report, partition_fname
+)
+
+STORE_VERSION = 2 #* bump when SCHEMA changes; kept in the database's user_version
+
+#one row per facility, sample point, parameter, monitoring period, & outfall (the natural key), with the columns of ReportRow
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    seq INTEGER PRIMARY KEY,
+    facility TEXT NOT NULL,
+    outfall TEXT NOT NULL,
+    sample_point TEXT NOT NULL,
+    parameter TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    avg_stat_base TEXT,
+    max_stat_base TEXT,
+    value_avg TEXT,
+    value_max TEXT,
+    source TEXT NOT NULL,
+    line_num INTEGER NOT NULL,
+    UNIQUE (facility, sample_point, parameter, start_date, outfall)
+);
+CREATE INDEX IF NOT EXISTS readings_by_parameter ON readings (sample_point, parameter, start_date);
+"""
+
+UPSERT = """
+INSERT INTO readings (facility, outfall, sample_point, parameter, start_date, month, avg_stat_base, max_stat_base, value_avg, value_max, source, line_num)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (facility, sample_point, parameter, start_date, outfall) DO UPDATE SET
+    avg_stat_base = excluded.avg_stat_base,
+    max_stat_base = excluded.max_stat_base,
+    value_avg = excluded.value_avg,
+    value_max = excluded.value_max,
+    source = excluded.source,
+    line_num = excluded.line_num
+"""
+
+class ReportStore:
+    """
+    SQLite database of cleaned report rows, de-duplicated on facility, sample point, parameter, "Mon. Period Start Date", & outfall.
+
+    The unique key doubles as the index for get_values(), which reads each bucket's most recent rows straight from it
+    instead of going through every row.
+    """
+
+    def __init__(self, db_file, facility_columns=("Permit ID",)):
+        """
+        Args:
+            db_file - string; the database file, created if missing.
+            facility_columns - list; report columns that tell facilities apart, e.g. ["Permit ID", "Outfall"]. Their values are joined with "|".
+                OUTFALL_COLUMNS not among them are part of the natural key when the report has them, so one permit's outfalls
+                don't replace each other's rows.
+        """
+        self.db_file = db_file
+        self.facility_columns = list(facility_columns)
+        taken = [entry.lower() for entry in self.facility_columns]
+        self.outfall_columns = [entry for entry in OUTFALL_COLUMNS if entry.lower() not in taken]
+        self.conn = sqlite3.connect(db_file)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, STORE_VERSION):
+            self.conn.close()
+            raise ValueError(f"\nERROR: {db_file} was made by a different version of report_store.py.\n")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _iter_params(self, this_file, counts):
+        n = len(self.facility_columns)
+        report = iter_report(this_file, compact=True, extra_columns=self.facility_columns, optional_columns=self.outfall_columns)
+        for line_num, row in iter_clean(report, in_place=True):
+            counts["rows"] += 1
+            if row.start_date is None or row.sample_point is None or row.parameter is None:
+                counts["skipped"] += 1 #* no natural key
+                continue
+            outfall = "|".join(value.strip() for value in row.extra[n:] if value.strip()) #* "" for reports without an outfall column
+            yield (
+                "|".join(value.strip() for value in row.extra[:n]), outfall, row.sample_point, row.parameter, str(row.start_date), row.start_date.month,
+                row.avg_stat_base, row.max_stat_base, row.value_avg, row.value_max, this_file, line_num
+            )
+
+    def ingest(self, this_file):
+        """
+        Add every row of a report in one transaction; a row with the same natural key as one already stored replaces it.
+
+        Args:
+            this_file - string; the report, in any format iter_report() reads.
+
+        Returns:
+            counts - dictionary; rows read, rows skipped for lacking a sample point, parameter, or date, & rows new to the database.
+        """
+        counts = {"rows": 0, "skipped": 0, "new": 0}
+        before = self.conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+        with self.conn: #* one transaction: all of the report or none of it
+            self.conn.executemany(UPSERT, self._iter_params(this_file, counts)) #* rows are streamed into sqlite, not collected first
+        counts["new"] = self.conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0] - before
+
+        return counts
+
+    def facilities(self):
+        """
+        Returns:
+            list; every facility in the database, sorted.
+        """
+        return [facility for facility, in self.conn.execute("SELECT DISTINCT facility FROM readings ORDER BY facility")]
+
+    def get_values(self, facility=None, rules=EXTRACTION_RULES, sample_point=SAMPLE_POINT):
+        """
+        Retrieve the values for ammonia, temperature, and pH from the stored rows, with one indexed query per bucket.
+
+        Same results as stream_values() on a report holding the same rows; ties on date go to the row stored first.
+
+        Args:
+            facility - string; only use this facility's rows, see facility_columns. None uses every facility.
+            rules - list; what to retrieve, see EXTRACTION_RULES.
+            sample_point - string; only rows with this (cleaned) "Sample Point Description" are used. None uses every row.
+
+        Returns:
+            extracted_vals - dictionary; same layout as get_values() in extract_report_values.py.
+        """
+        where = []
+        params = []
+        for name, value in [("facility", facility), ("sample_point", sample_point)]:
+            if value is not None:
+                where.append(f"{name} = ?")
+                params.append(value)
+
+        stream = ValueStream(rules, sample_point)
+        filters = f"WHERE {' AND '.join(where)}" if where else ""
+        stream.effluent_rows = self.conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM readings {filters} LIMIT 1)", params).fetchone()[0] #* 0 or 1, for the same check as stream_values()
+        for rule in rules:
+            for bucket in rule["buckets"]:
+                column = ReportRow.FIELDS[bucket.get("column", rule.get("column"))] #* fixed names, safe to put in the query
+                months = list(bucket["months"])
+                conditions = where + ["parameter = ?", f"month IN ({', '.join('?' * len(months))})"]
+                query = f"SELECT start_date, seq, {column} FROM readings WHERE {' AND '.join(conditions)} ORDER BY start_date DESC, seq LIMIT ?"
+                for start_date, seq, value in self.conn.execute(query, params + [rule["parameter"]] + months + [bucket["size"]]):
+                    stream.buckets[bucket["label"]].add(datetime.datetime.fromisoformat(start_date), seq, value)
+
+        return stream.result()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Keep report rows in a SQLite database & extract values from it.")
+    parser.add_argument("db_file", help="the database file, created if missing")
+    parser.add_argument("--ingest", metavar="REPORT", nargs="+", help="add these reports (files, folders, or glob patterns) to the database")
+    parser.add_argument("--facility", help="export the values for this facility; leave out to use every facility")
+    parser.add_argument("--facility-column", action="append", help="column(s) that tell facilities apart (default: \"Permit ID\"); repeat for more columns. Rows of different outfalls never replace each other")
+    parser.add_argument("--no-export", action="store_true", help="only ingest, don't export values")
+    parser.add_argument("--format", default="report", choices=list(EXPORT_FORMATS), help="output layout, see extract_report_values.py")
+    parser.add_argument("--output", metavar="PATH", help="write to this file instead of <datetime>_VALUES_FOR-<db_file>__<facility>; \"-\" writes to stdout")
+    args = parser.parse_args()
+
+    try:
+        with ReportStore(args.db_file, args.facility_column or ["Permit ID"]) as store:
+            for this_file in find_reports(args.ingest or []):
+                counts = store.ingest(this_file)
+                print(f"{this_file}: {counts['rows']} rows read, {counts['new']} new, {counts['skipped']} skipped.")
+            if not args.no_export:
+                found_values = store.get_values(args.facility)
+                output = export_values(found_values, partition_fname(args.db_file, (args.facility or "all",)), fmt=args.format, out_path=args.output)
+                if output != "-":
+                    print(f"Exported values to {output}.")
+    except Exception as e:
+        print(e)
@@ -0,0 +1,78 @@
+import unittest
+import csv
+import os
+import tempfile
+import shutil
+from report_store import *
+from bench_report_values import HEADER_ROW, iter_generated_rows
+from extract_report_values import stream_values
+
+def write_report(fname, rows):
+    with open(fname, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(HEADER_ROW)
+        writer.writerows(rows)
+    return fname
+
+class Test_ReportStore(unittest.TestCase):
+    """
+    Test ReportStore keeps one row per natural key & gives the same values as reading the reports.
+    """
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.store_dir, "history.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+
+    def test_same_as_stream_values(self):
+        fname = write_report(os.path.join(self.store_dir, "a.csv"), iter_generated_rows(5000))
+        with ReportStore(self.db_file) as store:
+            self.assertEqual(store.ingest(fname), {"rows": 5000, "skipped": 0, "new": 5000})
+            self.assertEqual(store.get_values(), stream_values(fname))
+            write_report(os.path.join(self.store_dir, "b.csv"), [row for row in iter_generated_rows(5000) if row[0] == "WA0000002"])
+            self.assertEqual(store.get_values("WA0000002"), stream_values(os.path.join(self.store_dir, "b.csv")))
+
+    def test_dedup(self):
+        rows = list(iter_generated_rows(2000))
+        fixed = [row[:10] + ["99.9"] + row[11:] if row[4] == "Nitrogen, Ammonia Total (as N)" else row for row in rows]
+        with ReportStore(self.db_file) as store:
+            store.ingest(write_report(os.path.join(self.store_dir, "a.csv"), rows))
+            counts = store.ingest(write_report(os.path.join(self.store_dir, "b.csv"), fixed)) # re-submitted, with corrected values
+            self.assertEqual(counts["new"], 0)
+            self.assertEqual(store.conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0], len(rows))
+            self.assertEqual(store.get_values()["Ammonia summer acute max"], 99.9)
+
+    def test_facilities(self):
+        with ReportStore(self.db_file, ["Permit ID", "Outfall"]) as store:
+            store.ingest(write_report(os.path.join(self.store_dir, "a.csv"), iter_generated_rows(10000)))
+            self.assertEqual([i.split("|")[0] for i in store.facilities()], ["WA0000001", "WA0000002", "WA0000003"])
+            with self.assertRaises(AssertionError):
+                store.get_values("WA0000001") # needs the outfall too
+
+    def test_outfalls_kept(self):
+        rows = [row for row in iter_generated_rows(4000) if row[0] == "WA0000001"]
+        rows += [row[:2] + ["999"] + row[3:] for row in rows] # a second outfall reporting the same months
+        with ReportStore(self.db_file) as store: # default facility columns, so the outfall is only in the natural key
+            self.assertEqual(store.ingest(write_report(os.path.join(self.store_dir, "a.csv"), rows))["new"], len(rows))
+            self.assertEqual(store.facilities(), ["WA0000001"])
+            self.assertEqual(store.get_values("WA0000001"), stream_values(os.path.join(self.store_dir, "a.csv")))
+
+    def test_old_version(self):
+        with ReportStore(self.db_file) as store:
+            store.conn.execute("PRAGMA user_version = 1")
+        with self.assertRaises(ValueError):
+            ReportStore(self.db_file)
+
+    def test_uses_index(self):
+        with ReportStore(self.db_file) as store:
+            plan = store.conn.execute(
+                "EXPLAIN QUERY PLAN SELECT start_date, seq, value_avg FROM readings WHERE facility = ? AND sample_point = ? AND parameter = ? AND month IN (?, ?)"
+                " ORDER BY start_date DESC, seq LIMIT 5",
+                ["a", "b", "c", 1, 2]
+            ).fetchall()
+            self.assertIn("INDEX sqlite_autoindex_readings_1", " ".join(str(i) for i in plan))
+            self.assertNotIn("TEMP B-TREE FOR ORDER BY", " ".join(str(i) for i in plan)) # read in date order; only rows of one date are sorted, by seq
+
+unittest.main(verbosity=2)